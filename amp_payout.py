@@ -0,0 +1,119 @@
+#    MIT License - Valerio Vaccaro
+#    AMP asset payouts through the AMP0 wallet
+
+import threading
+import time
+import requests
+from lwk import Address, Amp0Pset, Mnemonic, Signer
+from cache import TTLCache
+from metrics import stage
+
+
+class AmpPayout(object):
+    def __init__(self, network, amp0, amp0_wollet, amp0_client, mnemonic,
+                 url, token, assetid, gaid_ttl=300, interval=10, max_stale=60):
+        self._network = network
+        self._amp0 = amp0
+        self.wollet = amp0_wollet
+        self._client = amp0_client
+        # deriving the keys is expensive, the signer lives as long as the app
+        self._signer = Signer(Mnemonic(mnemonic), network)
+        self._url = url
+        self._assetid = assetid
+        self._session = requests.Session()
+        self._session.headers.update({'content-type': 'application/json',
+                                      'Authorization': f'token {token}'})
+        self._gaids = TTLCache(gaid_ttl, name='gaids')
+        self._interval = interval
+        self._max_stale = max_stale
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._pay_lock = threading.Lock()
+        self._thread = None
+        self.synced_at = 0
+        self.balance = dict(amp0_wollet.balance())
+
+    def _amp_get(self, path):
+        with stage('amp_api'):
+            return self._session.get(self._url + path, timeout=15).json()
+
+    def validate(self, gaid):
+        key = 'validate/' + gaid
+        valid = self._gaids.get(key)
+        if valid is None:
+            valid = self._amp_get(f'gaids/{gaid}/validate')['is_valid']
+            self._gaids.set(key, valid)
+        return valid
+
+    def address(self, gaid):
+        # returns the address registered for the GAID, None on errors
+        key = 'address/' + gaid
+        address = self._gaids.get(key)
+        if address is None:
+            result = self._amp_get(f'gaids/{gaid}/address')
+            if result['error'] != '':
+                return None
+            address = result['address']
+            self._gaids.set(key, address)
+        return address
+
+    def sync(self):
+        with self._sync_lock, stage('amp0_sync'):
+            last_index = self._amp0.last_index()
+            update = self._client.full_scan_to_index(self.wollet, last_index)
+            if update is not None:
+                with self._lock:
+                    self.wollet.apply_update(update)
+                    self.balance = dict(self.wollet.balance())
+            self.synced_at = time.time()
+
+    def ensure_synced(self):
+        if time.time() - self.synced_at > self._max_stale:
+            self.sync()
+
+    def pay(self, address, amount):
+        self.ensure_synced()
+
+        # finish_for_amp0 picks the coins itself and they are only marked
+        # spent by apply_transaction, so payouts run one at a time up to
+        # there; the background sync only waits for self._lock
+        with self._pay_lock:
+            return self._pay(address, amount)
+
+    def _pay(self, address, amount):
+        # Create transaction
+        with self._lock, stage('amp0_finish'):
+            builder = self._network.tx_builder()
+            builder.add_recipient(Address(address), amount, self._assetid)
+            amp0pset = builder.finish_for_amp0(self.wollet)
+
+        # Sign with the user key
+        pset = amp0pset.pset()
+        with stage('amp0_sign'):
+            pset = self._signer.sign(pset)
+
+        # Ask AMP0 to cosign
+        amp0pset = Amp0Pset(pset, amp0pset.blinding_nonces())
+        with stage('amp0_cosign'):
+            tx = self._amp0.sign(amp0pset)
+
+        # Broadcast
+        with stage('amp0_broadcast'):
+            txid = self._client.broadcast(tx)
+        with self._lock:
+            self.wollet.apply_transaction(tx)
+            self.balance = dict(self.wollet.balance())
+        return str(txid)
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                print('AMP0 wallet sync failed: ' + str(e))
+            time.sleep(self._interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
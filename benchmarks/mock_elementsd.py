@@ -0,0 +1,187 @@
+#    MIT License - Valerio Vaccaro
+#    Stand-in elementsd JSON-RPC server serving a synthetic chain
+
+import hashlib
+import http.server
+import json
+import threading
+import time
+
+
+def digest(*parts):
+    return hashlib.sha256('-'.join([str(p) for p in parts]).encode()).hexdigest()
+
+
+def chain_id(kind, height, *parts):
+    # block hashes and txids start with their height, so any of them can be
+    # served without keeping the chain in memory
+    return '%016x' % height + digest(kind, height, *parts)[16:]
+
+
+def height_of(id):
+    return int(id[:16], 16)
+
+
+class MockElementsd(object):
+    def __init__(self, blocks=1000, txs_per_block=10, mempool=2000, latency=0,
+                 block_interval=0, host='127.0.0.1', port=0):
+        # latency is added to every HTTP round trip, a batch pays it once
+        self.height = blocks
+        self._txs_per_block = txs_per_block
+        self._latency = latency
+        self._block_interval = block_interval
+        self._lock = threading.Lock()
+        self._mempool = [digest('mempool', i) for i in range(mempool)]
+        self._mempool_set = set(self._mempool)
+        self._mempool_sequence = 1
+        self.calls = 0
+        self._server = http.server.ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.url = 'http://user:password@%s:%d' % self._server.server_address
+
+    def _handler(self):
+        node = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body leave in one segment, or Nagle and delayed
+            # ACKs add 40ms to every keep-alive round trip
+            wbufsize = -1
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if node._latency > 0:
+                    time.sleep(node._latency)
+                if isinstance(request, list):
+                    response = [node.dispatch(r) for r in request]
+                else:
+                    response = node.dispatch(request)
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def block_hash(self, height):
+        return chain_id('block', height)
+
+    def txids(self, height):
+        return [chain_id('tx', height, i) for i in range(self._txs_per_block)]
+
+    def _height_of(self, hash):
+        height = height_of(hash)
+        if height > self.height or self.block_hash(height) != hash:
+            raise KeyError(hash)
+        return height
+
+    def _tx(self, txid, height=None):
+        data = {'txid': txid, 'hash': txid, 'version': 2, 'size': 2517, 'vsize': 1380,
+                'weight': 5517, 'locktime': 0,
+                'vin': [{'txid': digest('prevout', txid), 'vout': 0,
+                         'scriptSig': {'asm': '', 'hex': ''}, 'is_pegin': False,
+                         'sequence': 4294967293}],
+                'vout': [{'value-minimum': 0.00000001, 'value-maximum': 687.19476736,
+                          'n': n, 'valuecommitment': '08' + digest('value', txid, n),
+                          'assetcommitment': '0a' + digest('asset', txid, n),
+                          'scriptPubKey': {'asm': '0 ' + digest('spk', txid, n)[:40],
+                                           'hex': '0014' + digest('spk', txid, n)[:40],
+                                           'type': 'witness_v0_keyhash'}}
+                         for n in range(2)]}
+        if height is not None:
+            data['blockhash'] = self.block_hash(height)
+            data['confirmations'] = self.height - height + 1
+            data['time'] = data['blocktime'] = 1700000000 + height * 60
+        return data
+
+    def _block(self, height, verbosity):
+        txids = self.txids(height)
+        data = {'hash': self.block_hash(height), 'confirmations': self.height - height + 1,
+                'height': height, 'version': 536870912, 'size': 1000 + 2517 * len(txids),
+                'weight': 4000 + 5517 * len(txids), 'time': 1700000000 + height * 60,
+                'mediantime': 1700000000 + height * 60 - 300, 'nTx': len(txids),
+                'merkleroot': digest('merkle', height),
+                'previousblockhash': self.block_hash(height - 1)}
+        if verbosity >= 2:
+            data['tx'] = [self._tx(txid, height) for txid in txids]
+        else:
+            data['tx'] = txids
+        return data
+
+    def _advance(self):
+        # with a block interval the chain grows and confirms the mempool
+        if self._block_interval <= 0:
+            return
+        with self._lock:
+            target = self._base + int((time.time() - self._started) / self._block_interval)
+            while self.height < target:
+                self.height += 1
+                mempool = self._mempool[self._txs_per_block:] + \
+                    [digest('mempool', self.height, i) for i in range(self._txs_per_block)]
+                self._mempool_set = set(mempool)
+                self._mempool = mempool
+                self._mempool_sequence += 1
+
+    def call(self, method, params):
+        self.calls += 1
+        self._advance()
+        if method == 'getblockchaininfo':
+            return {'chain': 'liquidtestnet', 'blocks': self.height, 'headers': self.height,
+                    'bestblockhash': self.block_hash(self.height),
+                    'time': 1700000000 + self.height * 60, 'size_on_disk': 1024 * 1024 * 1024}
+        if method == 'getblockcount':
+            return self.height
+        if method == 'getblockhash':
+            if params[0] > self.height or params[0] < 0:
+                raise Exception('Block height out of range')
+            return self.block_hash(params[0])
+        if method == 'getblock':
+            return self._block(self._height_of(params[0]), params[1] if len(params) > 1 else 1)
+        if method == 'getrawtransaction':
+            txid = params[0]
+            if txid in self._mempool_set:
+                return self._tx(txid)
+            height = height_of(txid)
+            if height > self.height or txid not in self.txids(height):
+                raise Exception('No such mempool or blockchain transaction')
+            return self._tx(txid, height)
+        if method == 'getrawmempool':
+            if len(params) > 1 and params[1]:
+                return {'txids': self._mempool, 'mempool_sequence': self._mempool_sequence}
+            return self._mempool
+        if method == 'getmempoolinfo':
+            return {'size': len(self._mempool), 'bytes': 1380 * len(self._mempool)}
+        if method == 'validateaddress':
+            return {'isvalid': True, 'address': params[0], 'confidential_key': ''}
+        if method == 'testmempoolaccept':
+            return [{'txid': digest('raw', tx), 'allowed': True} for tx in params[0]]
+        if method == 'sendrawtransaction':
+            return digest('raw', params[0])
+        if method in ('walletpassphrase', 'uptime'):
+            return None
+        raise Exception('Method not found')
+
+    def dispatch(self, request):
+        try:
+            result = self.call(request['method'], request.get('params', []))
+            return {'result': result, 'error': None, 'id': request.get('id')}
+        except KeyError:
+            return {'result': None, 'error': {'code': -5, 'message': 'Block not found'},
+                    'id': request.get('id')}
+        except Exception as e:
+            return {'result': None, 'error': {'code': -1, 'message': str(e)},
+                    'id': request.get('id')}
+
+    def start(self):
+        self._started = time.time()
+        self._base = self.height
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
@@ -0,0 +1,101 @@
+#    MIT License - Valerio Vaccaro
+#    Stand-in Esplora REST server for the LWK wallet scans
+
+import hashlib
+import http.server
+import struct
+import threading
+import time
+
+
+def header(height):
+    # a pre-dynafed Elements header with an OP_TRUE challenge and no solution
+    return struct.pack('<I', 0x20000000) + b'\0' * 64 + \
+        struct.pack('<II', 1700000000 + height * 60, height) + b'\x01\x51\x00'
+
+
+def header_hash(height):
+    # the block hash does not commit to the solution
+    return hashlib.sha256(hashlib.sha256(header(height)[:-1]).digest()).digest()[::-1].hex()
+
+
+class MockEsplora(object):
+    def __init__(self, height=1000, latency=0, host='127.0.0.1', port=0):
+        # every wallet address has an empty history, so a scan costs one
+        # request per address up to the gap limit
+        self.height = height
+        self._latency = latency
+        self._heights = {header_hash(height): height}
+        self.requests = 0
+        self._server = http.server.ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.url = 'http://%s:%d' % self._server.server_address
+
+    def _handler(self):
+        esplora = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body leave in one segment, or Nagle and delayed
+            # ACKs add 40ms to every keep-alive round trip
+            wbufsize = -1
+
+            def _reply(self, body, status=200):
+                body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                esplora.requests += 1
+                if esplora._latency > 0:
+                    time.sleep(esplora._latency)
+                body = esplora.get(self.path)
+                if body is None:
+                    self._reply('Not found', 404)
+                else:
+                    self._reply(body)
+
+            def do_POST(self):
+                esplora.requests += 1
+                raw = self.rfile.read(int(self.headers['Content-Length']))
+                if esplora._latency > 0:
+                    time.sleep(esplora._latency)
+                if self.path != '/tx':
+                    self._reply('Not found', 404)
+                else:
+                    self._reply(hashlib.sha256(raw).hexdigest())
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def get(self, path):
+        parts = path.strip('/').split('/')
+        if path == '/blocks/tip/height':
+            return str(self.height)
+        if path == '/blocks/tip/hash':
+            return header_hash(self.height)
+        if parts[0] == 'block-height' and len(parts) == 2:
+            height = int(parts[1])
+            if height > self.height:
+                return None
+            hash = header_hash(height)
+            self._heights[hash] = height
+            return hash
+        if parts[0] == 'block' and len(parts) == 3 and parts[2] == 'header':
+            if parts[1] not in self._heights:
+                return None
+            return header(self._heights[parts[1]]).hex()
+        if parts[0] in ('address', 'scripthash') and parts[-1] == 'txs':
+            return '[]'
+        return None
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
@@ -0,0 +1,68 @@
+#    MIT License - Valerio Vaccaro
+#    Rate limit checks per second for the memory and SQLite storages
+#
+#    python benchmarks/ratelimit.py --processes 4 --seconds 5
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from limits import parse_many
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+import ratelimit_storage  # registers sqlite://
+
+# the limits of /api/faucet, checked the way Flask-Limiter does per request
+LIMITS = '1000/day;100/hour;3/minute'
+
+
+def worker(uri, seconds, clients, results):
+    limiter = FixedWindowRateLimiter(storage_from_string(uri))
+    limits = parse_many(LIMITS)
+    checks = 0
+    client = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        key = str(os.getpid()) + '-' + str(client % clients)
+        for limit in limits:
+            limiter.hit(limit, 'faucet', key)
+            checks += 1
+        client += 1
+    results.put(checks)
+
+
+def run(uri, processes, seconds, clients):
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker, args=(uri, seconds, clients, results))
+               for i in range(processes)]
+    for w in workers:
+        w.start()
+    checks = sum([results.get() for w in workers])
+    for w in workers:
+        w.join()
+    return checks / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--path', default=None)
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(tempfile.mkdtemp(), 'ratelimit.sqlite')
+    # memory:// is per process, it is only the reference for one worker
+    runs = [('memory://', 1), ('sqlite://' + path, 1), ('sqlite://' + path, args.processes)]
+    for uri, processes in runs:
+        rate = run(uri, processes, args.seconds, args.clients)
+        print('%-10s %3d processes %12.0f checks/s' % (uri.split(':')[0], processes, rate))
+
+
+if __name__ == '__main__':
+    main()
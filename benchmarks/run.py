@@ -0,0 +1,267 @@
+#    MIT License - Valerio Vaccaro
+#    Endpoint benchmarks against a stand-in elementsd and Esplora
+#
+#    python benchmarks/run.py --concurrency 16 --duration 10 --save after.json \
+#        --compare before.json
+
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, REPO)
+
+import requests
+from mock_elementsd import MockElementsd, chain_id
+from mock_esplora import MockEsplora
+
+MNEMONIC = 'abandon abandon abandon abandon abandon abandon abandon abandon abandon abandon abandon about'
+ADDRESS = 'tlq1qq2xvpcvfup5j8zscjq05u2wxxjcyewk7979f3mmz5l7uw5pqmx6xf5xy50hsn6vhkm5euwt72x878eq6zxx2z58hd7zrsg9qn'
+
+SERVER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import faucet
+faucet.follower.start()
+faucet.app.run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True)
+'''
+
+
+class PayoutStandIn(object):
+    # the payout daemon without AMP0 and without funds: wallet scans run for
+    # real against the stand-in Esplora, building, signing and broadcasting
+    # the payout are replaced by a fixed delay
+    METHODS = ('faucet', 'ticket', 'balance', 'sync_status', 'status', 'addresses')
+
+    def __init__(self, esplora_url, latency, max_stale):
+        from lwk import EsploraClient, Mnemonic, Network, Signer, Wollet
+        from wallet_coordinator import WalletCoordinator
+        network = Network.testnet()
+        signer = Signer(Mnemonic(MNEMONIC), network)
+        wollet = Wollet(network, signer.wpkh_slip77_descriptor(), None)
+        client = EsploraClient(esplora_url, network)
+        self._coordinator = WalletCoordinator(network, wollet, signer, client, {},
+                                              sync_interval=max_stale, max_stale=max_stale)
+        self._coordinator.sync()
+        self._latency = latency
+
+    def faucet(self, address, amount, asset, confidential):
+        self._coordinator.ensure_synced()
+        time.sleep(self._latency)
+        return {'txid': uuid.uuid4().hex * 2}
+
+    def ticket(self, id):
+        return None
+
+    def balance(self):
+        return {'balance': 0, 'balance_test': 0, 'balance_amp': 0}
+
+    def sync_status(self):
+        return self._coordinator.sync_status()
+
+    def status(self):
+        ready = {'ready': True, 'state': 'ready'}
+        return {'lwk': ready, 'amp0': ready}
+
+    def addresses(self):
+        return {'return_address': ADDRESS, 'amp0_return_address': ADDRESS}
+
+
+def backend(args, directory, queue):
+    # the stand-ins run in their own process, so they never compete for the
+    # GIL with the load generator
+    from payout_ipc import PayoutServer
+    node = MockElementsd(args.blocks, args.txs_per_block, args.mempool,
+                         args.rpc_latency / 1000, args.block_interval).start()
+    esplora = MockEsplora(args.blocks, args.esplora_latency / 1000).start()
+    service = PayoutStandIn(esplora.url, args.payout_latency / 1000, args.wallet_max_stale)
+    server = PayoutServer(os.path.join(directory, 'payout.sock'), service)
+    queue.put(node.url)
+    server.serve_forever()
+
+
+def configure(directory, node_url):
+    config = configparser.RawConfigParser()
+    config.read(os.path.join(REPO, 'liquid.conf.sample'))
+    address = node_url.split('@')[1]
+    config.set('GENERAL', 'ratelimit_storage', 'sqlite://' + os.path.join(directory, 'ratelimit.sqlite'))
+    config.set('LIQUID', 'host', address.split(':')[0])
+    config.set('LIQUID', 'port', address.split(':')[1])
+    config.set('LIQUID', 'username', 'user')
+    config.set('LIQUID', 'password', 'password')
+    config.set('EXPLORER', 'index', os.path.join(directory, 'index.sqlite'))
+    config.set('FAUCET', 'socket', os.path.join(directory, 'payout.sock'))
+    with open(os.path.join(directory, 'liquid.conf'), 'w') as f:
+        config.write(f)
+
+
+def free_port():
+    import socket
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def scenarios(args):
+    # name: (path for a random request, extra headers, response check)
+    def transaction(rng):
+        height = rng.randint(1, args.blocks)
+        return '/transaction?txid=' + chain_id('tx', height, rng.randrange(args.txs_per_block))
+
+    def faucet_headers(rng):
+        # every request looks like a new client, or the rate limits stop it
+        return {'X-Forwarded-For': '10.%d.%d.%d' % (rng.randrange(256), rng.randrange(256),
+                                                    rng.randrange(256))}
+
+    return {
+        'explorer': (lambda rng: '/explorer?start=%d' % rng.randint(120, args.blocks), None, None),
+        'block': (lambda rng: '/block?height=%d' % rng.randint(1, args.blocks), None, None),
+        'transaction': (transaction, None, None),
+        'mempool': (lambda rng: '/mempool', None, None),
+        'stats': (lambda rng: '/api/stats', None, None),
+        'faucet': (lambda rng: '/api/faucet?action=lbtc&address=' + ADDRESS, faucet_headers,
+                   lambda r: 'txid' in r.json()),
+    }
+
+
+def drive(base, scenario, concurrency, duration):
+    path, headers, check = scenario
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        mine = []
+        failed = 0
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                r = session.get(base + path(rng), headers=headers(rng) if headers else None,
+                                timeout=60)
+                ok = r.status_code < 400 and (check is None or check(r))
+            except Exception:
+                ok = False
+            mine.append(time.perf_counter() - started)
+            if not ok:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    if len(latencies) == 0:
+        return {'requests': 0, 'errors': 0, 'throughput': 0, 'p50': 0, 'p99': 0}
+    return {'requests': len(latencies), 'errors': errors[0],
+            'throughput': len(latencies) / duration,
+            'p50': latencies[int(len(latencies) * 0.50)] * 1000,
+            'p99': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000}
+
+
+def report(results):
+    print('%-12s %10s %10s %10s %10s %8s' % ('scenario', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for name, r in results.items():
+        print('%-12s %10d %10.1f %10.1f %10.1f %8d' % (name, r['requests'], r['throughput'],
+                                                        r['p50'], r['p99'], r['errors']))
+
+
+def compare(baseline, results, threshold):
+    # returns False when a scenario lost more than threshold percent of its
+    # throughput or grew its p99 by as much
+    print('%-12s %12s %12s %12s' % ('scenario', 'req/s', 'p50', 'p99'))
+    ok = True
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        b = baseline[name]
+        deltas = [100.0 * (r[k] - b[k]) / b[k] if b[k] else 0.0 for k in ('throughput', 'p50', 'p99')]
+        regressed = deltas[0] < -threshold or deltas[2] > threshold
+        print('%-12s %+11.1f%% %+11.1f%% %+11.1f%%%s' % (name, deltas[0], deltas[1], deltas[2],
+                                                          '  REGRESSION' if regressed else ''))
+        ok = ok and not regressed
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', default='explorer,block,transaction,mempool,stats,faucet')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--blocks', type=int, default=10000)
+    parser.add_argument('--txs-per-block', type=int, default=10)
+    parser.add_argument('--mempool', type=int, default=2000)
+    parser.add_argument('--block-interval', type=float, default=0,
+                        help='seconds between new blocks, 0 keeps the chain still')
+    parser.add_argument('--rpc-latency', type=float, default=1, help='ms per RPC round trip')
+    parser.add_argument('--esplora-latency', type=float, default=5, help='ms per Esplora request')
+    parser.add_argument('--payout-latency', type=float, default=50,
+                        help='ms standing in for building, signing and broadcasting a payout')
+    parser.add_argument('--wallet-max-stale', type=float, default=60)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='percent of throughput or p99 change counted as a regression')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    queue = multiprocessing.Queue()
+    stand_ins = multiprocessing.Process(target=backend, args=(args, directory, queue), daemon=True)
+    stand_ins.start()
+    configure(directory, queue.get(timeout=120))
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-c', SERVER, REPO, str(port)], cwd=directory,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = 'http://127.0.0.1:%d' % port
+    try:
+        for i in range(300):
+            try:
+                requests.get(base + '/robots.txt', timeout=1)
+                break
+            except requests.exceptions.RequestException:
+                time.sleep(0.1)
+
+        available = scenarios(args)
+        results = {}
+        for name in args.scenarios.split(','):
+            if args.warmup > 0:
+                drive(base, available[name], args.concurrency, args.warmup)
+            results[name] = drive(base, available[name], args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        stand_ins.terminate()
+
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=4, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print('')
+        if not compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
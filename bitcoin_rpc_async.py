@@ -0,0 +1,175 @@
+#    MIT License - Valerio Vaccaro
+#    Asyncio sibling of RPCHost with a bounded keep-alive connection pool
+
+import asyncio
+import base64
+import json
+import threading
+from urllib.parse import urlsplit, unquote
+from bitcoin_rpc_class import CircuitBreaker, RPCUnavailable
+from metrics import RPC_SECONDS, RPC_ERRORS
+
+
+class AsyncRPCHost(object):
+    def __init__(self, url, pool_size=8, concurrency=16, timeout=15, breaker=None):
+        parts = urlsplit(url)
+        if parts.hostname.endswith('.onion'):
+            raise Exception('Tor proxies are only supported by RPCHost.')
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        self._path = parts.path or '/'
+        credentials = unquote(parts.username or '') + ':' + \
+            unquote(parts.password or '')
+        self._auth = base64.b64encode(credentials.encode()).decode()
+        self._pool_size = pool_size
+        self._concurrency = concurrency
+        self._timeout = timeout
+        # share the breaker with the RPCHost of the same node
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._idle = []
+        self._slots = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    async def _connect(self):
+        return await asyncio.open_connection(self._host, self._port)
+
+    def _release(self, conn, reusable):
+        if reusable and len(self._idle) < self._pool_size:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by the node')
+        status = status_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        else:
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        reusable = headers.get('connection', '').lower() != 'close'
+        return int(status[1]), status[2].strip() if len(status) > 2 else '', body, reusable
+
+    async def _roundtrip(self, payload):
+        request = ('POST ' + self._path + ' HTTP/1.1\r\n'
+                   'Host: ' + self._host + ':' + str(self._port) + '\r\n'
+                   'Authorization: Basic ' + self._auth + '\r\n'
+                   'Content-Type: application/json\r\n'
+                   'Content-Length: ' + str(len(payload)) + '\r\n'
+                   'Connection: keep-alive\r\n\r\n').encode() + payload
+
+        # an idle connection may have been dropped by the node in the
+        # meantime, in that case try once more on a fresh one
+        for attempt in range(2):
+            fresh = len(self._idle) == 0
+            conn = self._idle.pop() if not fresh else await self._connect()
+            reader, writer = conn
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, reason, body, reusable = await self._read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if fresh or attempt == 1:
+                    raise
+                continue
+            except BaseException:
+                # timeouts and cancellations leave the stream in an unknown state
+                writer.close()
+                raise
+            self._release(conn, reusable)
+            return status, reason, body
+
+    async def _post(self, payload, deadline=None, method='batch'):
+        try:
+            self.breaker.check()
+        except RPCUnavailable:
+            RPC_ERRORS.inc(method, 'open')
+            raise
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+        timeout = deadline or self._timeout
+        async with self._slots:
+            try:
+                status, reason, body = await asyncio.wait_for(
+                    self._roundtrip(payload.encode()), timeout)
+            except asyncio.TimeoutError:
+                self.breaker.failure('timeout after ' + str(timeout) + 's')
+                RPC_ERRORS.inc(method, 'unavailable')
+                raise RPCUnavailable('RPC connection failure: timeout after ' +
+                                     str(timeout) + 's', self.breaker.retry_in())
+            except (OSError, asyncio.IncompleteReadError) as e:
+                self.breaker.failure(e)
+                RPC_ERRORS.inc(method, 'unavailable')
+                raise RPCUnavailable('Failed to connect for remote procedure call.',
+                                     self.breaker.retry_in())
+        self.breaker.success()
+        if status not in (200, 500):
+            RPC_ERRORS.inc(method, 'http')
+            raise Exception('RPC connection failure: ' +
+                            str(status) + ' ' + reason)
+        return json.loads(body)
+
+    async def call(self, rpcMethod, *params, deadline=None):
+        payload = json.dumps(
+            {"method": rpcMethod, "params": list(params), "jsonrpc": "2.0"})
+        with RPC_SECONDS.time(rpcMethod):
+            responseJSON = await self._post(payload, deadline, rpcMethod)
+        if 'error' in responseJSON and responseJSON['error'] is not None:
+            RPC_ERRORS.inc(rpcMethod, 'rpc')
+            raise Exception('Error in RPC call: ' + str(responseJSON['error']))
+        return responseJSON['result']
+
+    async def batch(self, calls, deadline=None):
+        # same contract as RPCHost.batch
+        if len(calls) == 0:
+            return []
+        payload = json.dumps([{"method": c[0], "params": list(c[1:]), "jsonrpc": "2.0", "id": i}
+                              for i, c in enumerate(calls)])
+        with RPC_SECONDS.time('batch'):
+            responseJSON = await self._post(payload, deadline)
+        if not isinstance(responseJSON, list):
+            raise Exception('Error in RPC batch: ' + str(responseJSON.get('error')))
+        results = [None] * len(calls)
+        for reply in responseJSON:
+            results[reply['id']] = {'result': reply.get('result'),
+                                    'error': reply.get('error')}
+        return results
+
+    async def _gather(self, calls):
+        return await asyncio.gather(*[self.call(*c) for c in calls])
+
+    def run(self, coro):
+        # the pool belongs to a private event loop thread, so plain threaded
+        # Flask handlers can submit coroutines and wait for the result
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def gather(self, *calls):
+        # calls are (method, param, ...) tuples issued concurrently, results
+        # come back in order and the first error is raised
+        return self.run(self._gather(calls))
@@ -3,13 +3,101 @@
 
 from __future__ import print_function
 import time
+import random
+import threading
 import requests
 import json
 import re
+from metrics import RPC_SECONDS, RPC_RETRIES, RPC_ERRORS
+
+
+class RPCUnavailable(Exception):
+    # raised without touching the network while the node is known to be down
+    def __init__(self, message, retry_in=0):
+        Exception.__init__(self, message)
+        self.retry_in = retry_in
+
+    def to_dict(self):
+        return {'error': 'node_unavailable', 'message': str(self),
+                'retry_in': round(self.retry_in, 1)}
+
+
+class RPCError(Exception):
+    # the node answered the call with an error, code is its JSON-RPC code
+    def __init__(self, error):
+        Exception.__init__(self, 'Error in RPC call: ' + str(error))
+        self.code = error.get('code') if isinstance(error, dict) else None
+
+
+class CircuitBreaker(object):
+    def __init__(self, threshold=3, cooldown=30):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = None
+        self.last_error = None
+
+    def retry_in(self):
+        if self._opened_at is None:
+            return 0
+        return max(0, self._opened_at + self._cooldown - time.monotonic())
+
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if self.retry_in() > 0:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        # once the cooldown has expired a single caller probes the node,
+        # the others keep failing fast until the probe succeeds
+        with self._lock:
+            state = self.state()
+            if state == 'closed':
+                return True
+            # a probe that never reported back does not block the next one
+            if state == 'half-open' and (self._probing is None or
+                                         time.monotonic() - self._probing > self._cooldown):
+                self._probing = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = None
+
+    def failure(self, error):
+        with self._lock:
+            self._failures += 1
+            self._probing = None
+            self.last_error = str(error)
+            if self._failures >= self._threshold or self._opened_at is not None:
+                self._opened_at = time.monotonic()
+
+    def check(self):
+        if not self.allow():
+            raise RPCUnavailable('Node unavailable, not retrying for ' +
+                                 str(round(self.retry_in(), 1)) + 's: ' +
+                                 str(self.last_error), self.retry_in())
+
+    def health(self):
+        return {'state': self.state(), 'failures': self._failures,
+                'last_error': self.last_error, 'retry_in': round(self.retry_in(), 1)}
 
 
 class RPCHost(object):
-    def __init__(self, url):
+    def __init__(self, url, deadline=15, tries=5, backoff=0.25, max_backoff=2,
+                 breaker=None):
+        self._deadline = deadline
+        self._tries = tries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
         self._session = requests.Session()
         if re.match(r'.*\.onion/*.*', url):
             self._session.proxies = {}
@@ -18,31 +106,208 @@ class RPCHost(object):
         self._url = url
         self._headers = {'content-type': 'application/json'}
 
-    def call(self, rpcMethod, *params):
-        payload = json.dumps(
-            {"method": rpcMethod, "params": list(params), "jsonrpc": "2.0"})
-        tries = 5
-        hadConnectionFailures = False
+    def healthy(self):
+        return self.breaker.state() == 'closed'
+
+    def _post(self, payload, deadline=None, method='batch'):
+        try:
+            self.breaker.check()
+        except RPCUnavailable:
+            RPC_ERRORS.inc(method, 'open')
+            raise
+        expires = time.monotonic() + (deadline or self._deadline)
+        attempt = 0
         while True:
+            remaining = expires - time.monotonic()
             try:
                 response = self._session.post(
-                    self._url, headers=self._headers, data=payload)
-            except requests.exceptions.ConnectionError:
-                tries -= 1
-                if tries == 0:
-                    raise Exception(
-                        'Failed to connect for remote procedure call.')
-                hadConnectionFailures = True
-                print("Couldn't connect for remote procedure call, will sleep for five seconds and then try again ({} more tries)".format(tries))
-                time.sleep(10)
+                    self._url, headers=self._headers, data=payload,
+                    timeout=max(remaining, 0.001))
+            except requests.exceptions.RequestException as e:
+                attempt += 1
+                # exponential backoff with full jitter, never past the deadline
+                delay = random.uniform(0, min(self._max_backoff,
+                                              self._backoff * 2 ** attempt))
+                if attempt >= self._tries or time.monotonic() + delay >= expires:
+                    self.breaker.failure(e)
+                    RPC_ERRORS.inc(method, 'unavailable')
+                    raise RPCUnavailable(
+                        'Failed to connect for remote procedure call.', self.breaker.retry_in())
+                print("Couldn't connect for remote procedure call, will sleep for {:.2f} seconds and then try again ({} more tries)".format(
+                    delay, self._tries - attempt))
+                RPC_RETRIES.inc(method)
+                time.sleep(delay)
             else:
-                if hadConnectionFailures:
+                if attempt > 0:
                     print('Connected for remote procedure call after retry.')
+                self.breaker.success()
                 break
         if response.status_code not in (200, 500):
+            RPC_ERRORS.inc(method, 'http')
             raise Exception('RPC connection failure: ' +
                             str(response.status_code) + ' ' + response.reason)
-        responseJSON = response.json()
+        return response.json()
+
+    def call(self, rpcMethod, *params, deadline=None):
+        payload = json.dumps(
+            {"method": rpcMethod, "params": list(params), "jsonrpc": "2.0"})
+        with RPC_SECONDS.time(rpcMethod):
+            responseJSON = self._post(payload, deadline, rpcMethod)
         if 'error' in responseJSON and responseJSON['error'] is not None:
-            raise Exception('Error in RPC call: ' + str(responseJSON['error']))
+            RPC_ERRORS.inc(rpcMethod, 'rpc')
+            raise RPCError(responseJSON['error'])
         return responseJSON['result']
+
+    def batch(self, calls, deadline=None):
+        # calls is a list of (method, param, ...) tuples, sent as a single
+        # JSON-RPC array; returns one {'result', 'error'} dict per call
+        if len(calls) == 0:
+            return []
+        payload = json.dumps([{"method": c[0], "params": list(c[1:]), "jsonrpc": "2.0", "id": i}
+                              for i, c in enumerate(calls)])
+        with RPC_SECONDS.time('batch'):
+            responseJSON = self._post(payload, deadline)
+        if not isinstance(responseJSON, list):
+            raise Exception('Error in RPC batch: ' + str(responseJSON.get('error')))
+        # replies are not guaranteed to keep the request order
+        results = [None] * len(calls)
+        for reply in responseJSON:
+            results[reply['id']] = {'result': reply.get('result'),
+                                    'error': reply.get('error')}
+        return results
+
+
+# calls that only read chain state and can be answered by any node in sync;
+# wallet calls, broadcasts and anything depending on the node's own mempool
+# (testmempoolaccept, getrawmempool and its sequence) stay on the primary
+READ_METHODS = frozenset(['getblock', 'getblockhash', 'getblockheader', 'getrawtransaction',
+                          'validateaddress', 'decoderawtransaction', 'gettxout'])
+# the chain tip is always asked to the most advanced node, so pollers never
+# see it jump back and forth between nodes
+TIP_METHODS = frozenset(['getblockchaininfo', 'getblockcount', 'getbestblockhash'])
+
+
+class RPCPool(object):
+    def __init__(self, nodes, max_lag=1, interval=5):
+        # nodes are RPCHost instances, each with its own breaker; the first
+        # one is the primary
+        self.nodes = nodes
+        self.primary = nodes[0]
+        self.breaker = self.primary.breaker
+        self._max_lag = max_lag
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._outstanding = [0] * len(nodes)
+        self._turn = 0
+        self._lagging = set()
+        self._thread = None
+        self.heights = [None] * len(nodes)
+
+    def healthy(self):
+        return any([n.healthy() for n in self.nodes])
+
+    def _acquire(self, tried, tip):
+        # the least busy healthy node in sync, replicas before the primary
+        # and in turns on ties; for the tip the most advanced one
+        with self._lock:
+            ready = [i for i, n in enumerate(self.nodes)
+                     if i not in tried and i not in self._lagging and n.healthy()]
+            if len(ready) == 0:
+                return None
+            if tip:
+                i = min(ready, key=lambda i: (-(self.heights[i] or 0), i))
+            else:
+                n = len(self.nodes)
+                i = min(ready, key=lambda i: (self._outstanding[i], i == 0,
+                                              (i - self._turn) % n))
+                self._turn = i + 1
+            self._outstanding[i] += 1
+            return i
+
+    def _release(self, i):
+        with self._lock:
+            self._outstanding[i] -= 1
+
+    def _read(self, fn, tip=False):
+        tried = []
+        while True:
+            i = self._acquire(tried, tip)
+            if i is None:
+                break
+            try:
+                return fn(self.nodes[i])
+            except RPCUnavailable:
+                tried.append(i)
+            except Exception:
+                # a replica slightly behind may not know a fresh block or
+                # transaction yet, the primary has the last word
+                if i == 0:
+                    raise
+                tried.append(i)
+                break
+            finally:
+                self._release(i)
+        if 0 in tried:
+            raise RPCUnavailable('No node available for remote procedure call.',
+                                 min([n.breaker.retry_in() for n in self.nodes]))
+        return fn(self.primary)
+
+    def call(self, rpcMethod, *params, deadline=None):
+        def fn(node):
+            return node.call(rpcMethod, *params, deadline=deadline)
+        if rpcMethod in READ_METHODS:
+            return self._read(fn)
+        if rpcMethod in TIP_METHODS:
+            return self._read(fn, tip=True)
+        return fn(self.primary)
+
+    def batch(self, calls, deadline=None):
+        def fn(node):
+            results = node.batch(calls, deadline=deadline)
+            # per call errors come back as results, from a replica they may
+            # only mean it is behind, so the batch is sent to the primary
+            if node is not self.primary and any([r['error'] is not None for r in results]):
+                raise Exception('Error in replica batch')
+            return results
+        if all([c[0] in READ_METHODS for c in calls]):
+            return self._read(fn)
+        return fn(self.primary)
+
+    def check_lag(self):
+        # nodes more than max_lag blocks behind the best one stop serving
+        # reads until they catch up
+        heights = []
+        for n in self.nodes:
+            try:
+                heights.append(n.call('getblockcount', deadline=min(self._interval, 5)))
+            except Exception:
+                heights.append(None)
+        known = [h for h in heights if h is not None]
+        best = max(known) if len(known) > 0 else 0
+        lagging = set([i for i, h in enumerate(heights)
+                       if h is None or h < best - self._max_lag])
+        with self._lock:
+            self.heights = heights
+            self._lagging = lagging
+
+    def status(self):
+        return [{'node': i, 'primary': i == 0, 'height': self.heights[i],
+                 'lagging': i in self._lagging, 'outstanding': self._outstanding[i],
+                 'state': n.breaker.state()} for i, n in enumerate(self.nodes)]
+
+    def _run(self):
+        while True:
+            try:
+                self.check_lag()
+            except Exception as e:
+                print('RPC pool lag check failed: ' + str(e))
+            time.sleep(self._interval)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
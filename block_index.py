@@ -0,0 +1,84 @@
+#    MIT License - Valerio Vaccaro
+#    Local index of block summaries used by the explorer
+
+import sqlite3
+import threading
+
+
+class BlockIndex(object):
+    def __init__(self, path, host, reorg_depth=6):
+        self._host = host
+        self._reorg_depth = reorg_depth
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS blocks ('
+                         'height INTEGER PRIMARY KEY, hash TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, time INTEGER NOT NULL, '
+                         'ntx INTEGER NOT NULL)')
+        self._db.commit()
+
+    def _select(self, start, last):
+        rows = self._db.execute('SELECT height, hash, size, time, ntx FROM blocks '
+                                'WHERE height <= ? AND height > ?', (start, last))
+        return {r[0]: {'id': r[0], 'hash': r[1], 'size': r[2], 'time': r[3], 'nTx': r[4]}
+                for r in rows}
+
+    def _rollback(self, height):
+        # the node has a different block at this height, everything from
+        # here up belongs to a stale branch
+        self._db.execute('DELETE FROM blocks WHERE height >= ?', (height,))
+
+    def _fetch(self, heights):
+        hashes = self._host.batch([('getblockhash', i) for i in heights])
+        found = [(i, h['result'])
+                 for i, h in zip(heights, hashes) if h['error'] is None]
+        blocks = self._host.batch([('getblock', hash) for i, hash in found])
+        data = []
+        for (i, hash), res in zip(found, blocks):
+            if res['error'] is not None:
+                continue
+            block = res['result']
+            data.append({'id': i, 'hash': hash,
+                         'size': block['size'], 'time': block['time'], 'nTx': block['nTx']})
+        return data
+
+    def hash(self, height, tip):
+        # only blocks deeper than the reorg window are trusted without
+        # asking the node
+        if height > tip - self._reorg_depth:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT hash FROM blocks WHERE height = ?',
+                                   (height,)).fetchone()
+        return row[0] if row is not None else None
+
+    def blocks(self, start, last, tip):
+        # returns the summaries for heights start..last+1 (descending), only
+        # blocks near the tip or missing from the index touch the node
+        with self._lock:
+            stored = self._select(start, last)
+
+            recent = [i for i in range(start, last, -1)
+                      if i > tip - self._reorg_depth and i in stored]
+            if len(recent) > 0:
+                hashes = self._host.batch([('getblockhash', i) for i in recent])
+                stale = [i for i, h in zip(recent, hashes)
+                         if h['error'] is not None or h['result'] != stored[i]['hash']]
+                if len(stale) > 0:
+                    self._rollback(min(stale))
+                    self._db.commit()
+                    stored = self._select(start, last)
+
+            missing = [i for i in range(start, last, -1) if i not in stored]
+            if len(missing) > 0:
+                fetched = self._fetch(missing)
+                self._db.executemany('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)',
+                                     [(b['id'], b['hash'], b['size'], b['time'], b['nTx'])
+                                      for b in fetched])
+                self._db.commit()
+                for b in fetched:
+                    stored[b['id']] = b
+
+        return [stored[i] for i in range(start, last, -1) if i in stored]
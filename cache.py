@@ -0,0 +1,64 @@
+#    MIT License - Valerio Vaccaro
+#    Small in-memory caches shared by the request handlers
+
+import collections
+import threading
+import time
+from metrics import cache_lookup
+
+
+class TTLCache(object):
+    def __init__(self, ttl, max_entries=10000, name=None):
+        # caches with a name report their hits and misses
+        self._name = name
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.time():
+            entry = None
+        if self._name is not None:
+            cache_lookup(self._name, entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            if len(self._data) >= self._max_entries:
+                # drop expired entries first, then the oldest ones
+                now = time.time()
+                self._data = {k: e for k, e in self._data.items() if e[0] >= now}
+                while len(self._data) >= self._max_entries:
+                    del self._data[next(iter(self._data))]
+            self._data[key] = (time.time() + (ttl or self._ttl), value)
+
+
+class LRUCache(object):
+    def __init__(self, max_bytes, name=None):
+        self._name = name
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+        if self._name is not None:
+            cache_lookup(self._name, entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value, size):
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.size -= self._data.pop(key)[0]
+            self._data[key] = (size, value)
+            self.size += size
+            while self.size > self._max_bytes:
+                self.size -= self._data.popitem(last=False)[1][0]
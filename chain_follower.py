@@ -0,0 +1,77 @@
+#    MIT License - Valerio Vaccaro
+#    Background poller publishing snapshots of the chain state
+
+import threading
+import time
+
+
+class ChainFollower(object):
+    def __init__(self, host, interval=2):
+        self._host = host
+        self._interval = interval
+        self._producers = []
+        self._listeners = []
+        self._snapshot = {}
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.info = None
+        self.updated = 0
+
+    def publish(self, name, producer, every_poll=False):
+        # producer is called when the tip changes (or on every poll) and its
+        # result is served by get(name) until the next refresh
+        self._producers.append((name, producer, every_poll))
+
+    def listen(self, callback):
+        # callback(changed) runs after every poll, once the new snapshot is
+        # in place
+        self._listeners.append(callback)
+
+    def fresh(self):
+        # snapshots older than a few intervals mean the poller is stuck or
+        # the node is unreachable, callers should fall back to the node
+        return self.info is not None and \
+            time.time() - self.updated < 5 * self._interval
+
+    def get(self, name):
+        # while the node is down the last snapshot is served as is, so read
+        # endpoints degrade to slightly stale data instead of erroring
+        if not self.fresh() and self._host.healthy():
+            return None
+        return self._snapshot.get(name)
+
+    def poll(self):
+        info = self._host.call('getblockchaininfo')
+        changed = self.info is None or \
+            info['bestblockhash'] != self.info['bestblockhash']
+        snapshot = dict(self._snapshot)
+        self.info = info
+        for name, producer, every_poll in self._producers:
+            if changed or every_poll:
+                snapshot[name] = producer()
+        # swap the whole dict so readers never see a half built snapshot
+        self._snapshot = snapshot
+        self.updated = time.time()
+        for callback in self._listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                print('Chain follower listener failed: ' + str(e))
+        return changed
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print('Chain follower poll failed: ' + str(e))
+            time.sleep(self._interval)
+
+    def start(self):
+        # called by every request, only the first one starts the thread
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
@@ -0,0 +1,79 @@
+#    MIT License - Valerio Vaccaro
+#    Server-Sent Events fan out of the chain follower updates
+
+import collections
+import json
+import threading
+
+
+def parse_id(value):
+    # ids are dash separated integers, compared as tuples
+    try:
+        return tuple(int(part) for part in value.split('-'))
+    except (AttributeError, ValueError):
+        return None
+
+
+class EventFeed(object):
+    def __init__(self, history=100, keepalive=15, max_clients=1000):
+        # the last history events are kept for clients reconnecting with
+        # Last-Event-ID, older ones get a reset and reload the page
+        self._cond = threading.Condition()
+        self._events = collections.deque(maxlen=history)
+        self._dropped = None
+        self._keepalive = keepalive
+        self._max_clients = max_clients
+        self.id = (0,)
+        self.clients = 0
+
+    def publish(self, event, id, data):
+        # the id comes from the chain state rather than a counter, so every
+        # worker process numbers the same update the same way and a client
+        # can reconnect to any of them
+        with self._cond:
+            if id <= self.id:
+                # a reorg to a lower height still has to come after what
+                # the clients have already seen
+                id = self.id + (1,)
+            self.id = id
+            frame = 'id: %s\nevent: %s\ndata: %s\n\n' % (
+                '-'.join(str(part) for part in id), event, json.dumps(data, separators=(',', ':')))
+            if len(self._events) == self._events.maxlen:
+                self._dropped = self._events[0][0]
+            self._events.append((id, frame.encode()))
+            self._cond.notify_all()
+
+    def _since(self, last_id):
+        # frames after last_id, None when some of them were already dropped
+        if self._dropped is not None and last_id < self._dropped:
+            return None
+        return [frame for id, frame in self._events if id > last_id]
+
+    def full(self):
+        return self.clients >= self._max_clients
+
+    def subscribe(self, last_id=None):
+        # one generator per client, it only waits on the shared condition
+        # and copies the frames already built by publish
+        with self._cond:
+            if last_id is None or last_id > self.id:
+                last_id = self.id
+            self.clients += 1
+        try:
+            yield b'retry: 5000\n\n'
+            while True:
+                with self._cond:
+                    if self.id == last_id:
+                        self._cond.wait(self._keepalive)
+                    frames = self._since(last_id)
+                    last_id = self.id
+                if frames is None:
+                    yield ('id: %s\nevent: reset\ndata: {}\n\n' % '-'.join(str(part) for part in last_id)).encode()
+                elif len(frames) > 0:
+                    yield b''.join(frames)
+                else:
+                    # keeps proxies from closing an idle stream
+                    yield b': keepalive\n\n'
+        finally:
+            with self._cond:
+                self.clients -= 1
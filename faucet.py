@@ -1,18 +1,36 @@
 from flask import (
     Flask,
+    Response,
+    g,
     request,
     jsonify,
 )
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_stache import render_template
 from flask_qrcode import QRcode
-from bitcoin_rpc_class import RPCHost
+from bitcoin_rpc_class import RPCHost, RPCPool, CircuitBreaker, RPCUnavailable
+from bitcoin_rpc_async import AsyncRPCHost
+from block_index import BlockIndex
+from chain_follower import ChainFollower
+from host_stats import StatsSnapshot, uptime, uname
+from cache import LRUCache, TTLCache
+from tx_cache import TransactionCache
+from template_engine import TemplateEngine
+from http_cache import conditional, short, IMMUTABLE
+from payout_ipc import PayoutClient
+from tx_stream import read_transactions
+import ratelimit_storage
+from metrics import registry, WorkerFiles, HTTP_SECONDS
+from profiler import SlowRequestProfiler
+from mempool_tracker import MempoolTracker
+from event_feed import EventFeed, parse_id
 import os
 import configparser
 import json
-import requests
+import zlib
+import threading
 import time
+from urllib.parse import urlsplit
 from lwk import *
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -20,54 +38,246 @@ app = Flask(__name__, static_url_path='/static')
 app.wsgi_app = ProxyFix(
     app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1
 )
+config = configparser.RawConfigParser()
+config.read('liquid.conf')
+
+liquid_instance = config.get('GENERAL', 'liquid_instance')
+# counters are shared by all the worker processes and kept across restarts
+rateLimitStorage = config.get('GENERAL', 'ratelimit_storage',
+                              fallback='sqlite://./.ratelimit.sqlite')
+
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
+    storage_uri=rateLimitStorage,
 )
 
 qrcode = QRcode(app)
 
-config = configparser.RawConfigParser()
-config.read('liquid.conf')
-
-liquid_instance = config.get('GENERAL', 'liquid_instance')
-
-rpcHost = config.get(liquid_instance, 'host')
-rpcPort = config.get(liquid_instance, 'port')
-rpcUser = config.get(liquid_instance, 'username')
-rpcPassword = config.get(liquid_instance, 'password')
 rpcPassphrase = config.get(liquid_instance, 'passphrase')
-rpcWallet = config.get(liquid_instance, 'wallet')
+rpcPoolSize = config.getint(liquid_instance, 'pool_size', fallback=8)
+rpcConcurrency = config.getint(liquid_instance, 'concurrency', fallback=16)
+rpcTimeout = config.getfloat(liquid_instance, 'timeout', fallback=15)
+rpcBreakerThreshold = config.getint(liquid_instance, 'breaker_threshold', fallback=3)
+rpcBreakerCooldown = config.getfloat(liquid_instance, 'breaker_cooldown', fallback=30)
+# sections of further nodes serving the read only calls
+rpcReplicas = [r.strip() for r in config.get(liquid_instance, 'replicas', fallback='').split(',')
+               if len(r.strip()) > 0]
+rpcMaxLag = config.getint(liquid_instance, 'max_lag', fallback=1)
+rpcLagInterval = config.getfloat(liquid_instance, 'lag_interval', fallback=5)
 
-ampUrl = config.get('AMP', 'url')
-ampToken = config.get('AMP', 'token')
-ampUuid = config.get('AMP', 'assetuuid')
-
-amp0_user = config.get('GDK', 'amp0_user')
-amp0_password = config.get('GDK', 'amp0_password')
 amp0_assetid = config.get('GDK', 'amp0_assetid')
-amp0_mnemonic = config.get('GDK', 'mnemonic')
 
-lwkMnemonic = config.get('LWK', 'mnemonic')
-lwkAddress = config.get('LWK', 'address')
+explorerIndex = config.get('EXPLORER', 'index', fallback='./.block_index.sqlite')
+explorerReorgDepth = config.getint('EXPLORER', 'reorg_depth', fallback=6)
+explorerPollInterval = config.getfloat('EXPLORER', 'poll_interval', fallback=2)
+statsTTL = config.getfloat('EXPLORER', 'stats_ttl', fallback=10)
+blockCacheMB = config.getfloat('EXPLORER', 'block_cache_mb', fallback=64)
+txCacheMB = config.getfloat('EXPLORER', 'tx_cache_mb', fallback=32)
+txCacheMempoolTTL = config.getfloat('EXPLORER', 'tx_cache_mempool_ttl', fallback=5)
+txCacheDB = config.get('EXPLORER', 'tx_cache_db', fallback='')
+pageCacheMB = config.getfloat('EXPLORER', 'page_cache_mb', fallback=8)
+eventsHistory = config.getint('EXPLORER', 'events_history', fallback=100)
+eventsKeepalive = config.getfloat('EXPLORER', 'events_keepalive', fallback=15)
+eventsMaxClients = config.getint('EXPLORER', 'events_max_clients', fallback=1000)
+
+faucetSocket = config.get('FAUCET', 'socket', fallback='./.payout.sock')
+faucetBatchWait = config.getfloat('FAUCET', 'batch_wait', fallback=30)
+faucetSyncInterval = config.getfloat('FAUCET', 'sync_interval', fallback=10)
+faucetBulkIssueMax = config.getint('FAUCET', 'bulk_issue_max', fallback=50)
+
 assetid = config.get('LWK', 'assetid')
 
-if (len(rpcWallet) > 0):
-    serverURL = 'http://' + rpcUser + ':' + rpcPassword + '@' + \
-        rpcHost + ':' + str(rpcPort) + '/wallet/' + rpcWallet
-else:
-    serverURL = 'http://' + rpcUser + ':' + \
+utilsBatchSize = config.getint('UTILS', 'batch_size', fallback=100)
+utilsMaxTransactions = config.getint('UTILS', 'max_transactions', fallback=1000)
+
+metricsProfileSlowMs = config.getfloat('METRICS', 'profile_slow_ms', fallback=0)
+metricsProfileIntervalMs = config.getfloat('METRICS', 'profile_interval_ms', fallback=5)
+metricsDirectory = config.get('METRICS', 'directory', fallback='./.metrics')
+metricsInterval = config.getfloat('METRICS', 'interval', fallback=5)
+
+def server_url(section):
+    rpcHost = config.get(section, 'host')
+    rpcPort = config.get(section, 'port')
+    rpcUser = config.get(section, 'username')
+    rpcPassword = config.get(section, 'password')
+    rpcWallet = config.get(section, 'wallet', fallback='')
+    if (len(rpcWallet) > 0):
+        return 'http://' + rpcUser + ':' + rpcPassword + '@' + \
+            rpcHost + ':' + str(rpcPort) + '/wallet/' + rpcWallet
+    return 'http://' + rpcUser + ':' + \
         rpcPassword + '@' + rpcHost + ':' + str(rpcPort)
 
-host = RPCHost(serverURL)
+
+serverURL = server_url(liquid_instance)
+
+breaker = CircuitBreaker(rpcBreakerThreshold, rpcBreakerCooldown)
+host = RPCHost(serverURL, deadline=rpcTimeout, breaker=breaker)
+rpc_pool = None
+if len(rpcReplicas) > 0:
+    # reads are spread over the replicas, wallet calls stay on the primary
+    rpc_pool = RPCPool([host] + [RPCHost(server_url(r), deadline=rpcTimeout,
+                                         breaker=CircuitBreaker(rpcBreakerThreshold,
+                                                                rpcBreakerCooldown))
+                                 for r in rpcReplicas],
+                       rpcMaxLag, rpcLagInterval)
+    host = rpc_pool
+# the asyncio client has no SOCKS support, nodes behind Tor use RPCHost only
+host_async = None
+if not urlsplit(serverURL).hostname.endswith('.onion'):
+    host_async = AsyncRPCHost(serverURL, rpcPoolSize, rpcConcurrency, rpcTimeout, breaker)
+
+
+def unlock_wallet():
+    # retried in the background, a node still starting must not keep the
+    # app from binding its port
+    while True:
+        try:
+            host.call('walletpassphrase', rpcPassphrase, 60)
+            return
+        except Exception as e:
+            print('Wallet unlock failed: ' + str(e))
+            time.sleep(rpcBreakerCooldown)
+
+
 if (len(rpcPassphrase) > 0):
-    result = host.call('walletpassphrase', rpcPassphrase, 60)
+    threading.Thread(target=unlock_wallet, daemon=True).start()
+
+block_index = BlockIndex(explorerIndex, host, explorerReorgDepth)
+follower = ChainFollower(host, explorerPollInterval)
+mempool_tracker = MempoolTracker(host)
+# pushed to the browsers, every client shares the follower's single poll
+feed = EventFeed(eventsHistory, eventsKeepalive, eventsMaxClients)
+feed_state = {'height': None, 'stats': None, 'sequence': None}
+# decoded blocks keyed by hash, kept zlib compressed
+block_cache = LRUCache(int(blockCacheMB * 1024 * 1024), 'blocks')
+tx_cache = TransactionCache(int(txCacheMB * 1024 * 1024), txCacheMempoolTTL, txCacheDB,
+                            explorerReorgDepth)
+# templates are parsed at startup, and again on change when debugging
+templates = TemplateEngine(os.path.join(app.root_path, app.template_folder),
+                           app.debug, int(pageCacheMB * 1024 * 1024))
+# wallets and signers live in the payout daemon, the web workers only
+# hold a client and can run as many processes as needed
+payouts = PayoutClient(faucetSocket, faucetBatchWait + 2 * rpcTimeout)
+network = Network.testnet()
+return_addresses = None
+# readiness of the wallets in the payout daemon, asked at most once a second
+wallet_status = TTLCache(1)
+WARMING_UP = 'The faucet is warming up, please retry in a few seconds.'
+titles = {'faucet': 'Liquid faucet', 'issuer': 'Liquid faucet', 'utils': 'Liquid faucet'}
+
+
+def render_template(template, key=None, /, **context):
+    # positional only, so context keys such as name or key never clash
+    context.setdefault('title', titles.get(template, 'Liquid testnet'))
+    return templates.render(template, context, key)
+
+
+# requests slower than profile_slow_ms are sampled and reported, off by default
+profiler = None
+if metricsProfileSlowMs > 0:
+    profiler = SlowRequestProfiler(metricsProfileSlowMs / 1000, metricsProfileIntervalMs / 1000)
+
+# shared by the worker processes, an empty directory keeps metrics per process
+worker_metrics = None
+if len(metricsDirectory) > 0:
+    worker_metrics = WorkerFiles(registry, metricsDirectory, metricsInterval)
+
+
+@app.before_request
+def start_request_timer():
+    g.started = time.perf_counter()
+    if profiler is not None:
+        profiler.begin()
+
+
+@app.teardown_request
+def record_request_time(error):
+    started = g.get('started')
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_SECONDS.observe(duration, route)
+    if profiler is not None:
+        profiler.end(request.method + ' ' + request.full_path, duration)
+
 
 def index_ratelimit_error_responder(request_limit):
     return jsonify({"error": "rate_limit_exceeded"})
 
+
+@app.errorhandler(RPCUnavailable)
+def rpc_unavailable_responder(e):
+    r = jsonify(e.to_dict())
+    r.status_code = 503
+    r.headers['Retry-After'] = str(int(e.retry_in) + 1)
+    return r
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def url_metrics():
+    # the payout daemon keeps the wallet stage timings, they are merged in
+    try:
+        families = payouts.call('metrics')
+    except Exception:
+        families = []
+    # every web worker keeps its own metrics, all of them are merged here
+    if worker_metrics is not None:
+        families = worker_metrics.collect() + families
+    return Response(registry.render(families, local=worker_metrics is None),
+                    mimetype='text/plain; version=0.0.4')
+
+
+def wallets():
+    status = wallet_status.get('status')
+    if status is None:
+        try:
+            status = payouts.call('status')
+        except Exception as e:
+            down = {'ready': False, 'state': 'unavailable', 'error': str(e)}
+            status = {'lwk': down, 'amp0': down}
+        wallet_status.set('status', status)
+    return status
+
+
+def warming_up(action):
+    # amp payouts come from the AMP0 wallet, everything else from LWK
+    return not wallets()['amp0' if action == 'amp' else 'lwk']['ready']
+
+
+def unavailable_response(data):
+    r = jsonify(data)
+    r.status_code = 503
+    r.headers['Retry-After'] = '5'
+    return r
+
+
+@app.route('/healthz', methods=['GET'])
+@limiter.exempt
+def url_healthz():
+    # the process is up and serving, whatever the state of its backends
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz', methods=['GET'])
+@limiter.exempt
+def url_readyz():
+    node = {'ready': follower.fresh() and host.healthy(), 'breaker': host.breaker.health()}
+    if follower.info is not None:
+        node['height'] = follower.info['blocks']
+    if rpc_pool is not None:
+        node['nodes'] = rpc_pool.status()
+    status = {'node': node}
+    status.update(wallets())
+    ready = all([s['ready'] for s in status.values()])
+    r = jsonify({'ready': ready, 'subsystems': status})
+    r.status_code = 200 if ready else 503
+    r.headers['Cache-Control'] = 'no-store'
+    return r
+
+
 @app.route('/robots.txt')
 def noindex():
     r = Response(response="User-Agent: *\nDisallow: /\n", status=200, mimetype="text/plain")
@@ -82,51 +292,118 @@ def wellKnownRoute(filename):
     return data
 
 
+# validators for conditional GETs, taken from the follower and never from
+# the node; deep blocks never change, everything else follows the tip
+def tip_validators(name, mempool=False):
+    if not follower.fresh():
+        return None
+    etag = name + '-' + follower.info['bestblockhash']
+    if mempool:
+        return etag + '-' + str(mempool_tracker.sequence), short(explorerPollInterval), None
+    return etag, short(explorerPollInterval), follower.info.get('time')
+
+
+def deep(height):
+    try:
+        height = int(height)
+    except (TypeError, ValueError):
+        return False
+    return 0 <= height <= follower.info['blocks'] - explorerReorgDepth
+
+
+def stats_validators():
+    return tip_validators('stats', mempool=True)
+
+
+def explorer_validators():
+    start = request.args.get('start')
+    if follower.fresh() and deep(start):
+        return 'explorer-' + str(int(start)), IMMUTABLE, None
+    return tip_validators('explorer')
+
+
+def block_validators():
+    # even a deep block is not immutable, its confirmations move with the tip
+    return tip_validators('block')
+
+
+def transaction_validators():
+    return tip_validators('transaction', mempool=True)
+
+
+def mempool_validators():
+    if not follower.fresh():
+        return None
+    return 'mempool-' + str(mempool_tracker.sequence), short(explorerPollInterval), None
+
+
 def stats():
-    info = host.call('getblockchaininfo')
-    mem = host.call('getmempoolinfo')
+    if follower.fresh():
+        info = follower.info
+        mem = host.call('getmempoolinfo')
+    elif host_async is not None:
+        info, mem = host_async.gather(
+            ('getblockchaininfo',), ('getmempoolinfo',))
+    else:
+        info = host.call('getblockchaininfo')
+        mem = host.call('getmempoolinfo')
     data = {
         'height': info['headers'],
-        'mempool': str(mem['size']) + ' tx (' + str(round(mem['size'] / (1024 * 1024), 3)) + ' MB)',
+        'mempool': str(mem['size']) + ' tx (' + str(round(mem['bytes'] / (1024 * 1024), 3)) + ' MB)',
         'space': str(round(info['size_on_disk'] / (1024 * 1024), 3)) + ' MB',
-        'uptime': os.popen("uptime").read(),
-        'uname': os.popen("uname -a").read(),
+        'uptime': uptime(),
+        'uname': uname(),
     }
     return data
 
 
+stats_snapshot = StatsSnapshot(stats, statsTTL)
+
+
 @app.route('/api/stats', methods=['GET'])
 @limiter.exempt
+@conditional(stats_validators)
 def api_stats():
-    data = stats()
+    data = stats_snapshot.get()
     return jsonify(data)
 
 
 @app.route('/', methods=['GET'])
 @limiter.exempt
 def url_home():
-    data = stats()
+    data = stats_snapshot.get()
     return render_template('home', **data)
 
 
-def explorer(start, last):
-    data = []
+def tip_height():
+    # with the node down the last known tip is better than an error
+    if follower.fresh() or (follower.info is not None and not host.healthy()):
+        return follower.info['blocks']
+    return host.call('getblockcount')
 
-    for i in range(start, last, -1):
-        hash = host.call('getblockhash', i)
-        block = host.call('getblock', hash)
-        data.append({'id': i, 'hash': hash,
-                    'size': block['size'], 'time': block['time'], 'nTx': block['nTx']})
 
+def explorer(start, last, tip):
+    page = follower.get('explorer')
+    if page is not None and page['start'] == start and page['last'] == last:
+        return page['blocks_list']
+    data = block_index.blocks(start, last, tip)
     return data
 
 
+def explorer_page():
+    elements = 120
+    start = follower.info['blocks']
+    last = max(start - elements, 0)
+    return {'start': start, 'last': last, 'blocks_list': block_index.blocks(start, last, start)}
+
+
 @app.route('/api/explorer', methods=['GET'])
 @limiter.exempt
+@conditional(explorer_validators)
 def api_explorer():
     elements = 120
     start = request.args.get('start')
-    max = host.call('getblockcount')
+    max = tip_height()
 
     try:
         start = int(start)
@@ -140,7 +417,9 @@ def api_explorer():
     if (last < 0):
         last = 0
 
-    data = explorer(start, last)
+    data = explorer(start, last, max)
+    # blocks the node failed to return leave the page short
+    g.incomplete = len(data) != start - last
     return jsonify(data)
 
 
@@ -149,7 +428,7 @@ def api_explorer():
 def url_explorer():
     elements = 120
     start = request.args.get('start')
-    max = host.call('getblockcount')
+    max = tip_height()
 
     try:
         start = int(start)
@@ -163,9 +442,70 @@ def url_explorer():
     if (last < 0):
         last = 0
 
+    # deep ranges never change, the rendered page is kept as is
+    key = None
+    if follower.fresh() and deep(start):
+        key = 'explorer-' + str(start)
+        page = templates.cached(key)
+        if page is not None:
+            return page
+
     data = {'blocks_list': explorer(
-        start, last), 'prev': start - elements, 'next': start + elements}
-    return render_template('explorer', **data)
+        start, last, max), 'prev': start - elements, 'next': start + elements}
+    # only the page at the tip follows the new blocks
+    data['live'] = start == max
+    # a page short of blocks the node failed to return is not kept
+    if len(data['blocks_list']) != start - last:
+        key = None
+    return render_template('explorer', key, **data)
+
+
+def fetch_block(height):
+    height = int(height)
+    tip = tip_height()
+    id = block_index.hash(height, tip)
+    if id is None:
+        id = host.call('getblockhash', height)
+    packed = block_cache.get(id)
+    if packed is not None:
+        data = json.loads(zlib.decompress(packed))
+    else:
+        data = host.call('getblock', id, 2)
+        # both change as the chain grows, they are filled in when served
+        data.pop('confirmations', None)
+        data.pop('nextblockhash', None)
+        packed = zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+        block_cache.set(id, packed, len(packed))
+    data['confirmations'] = max(tip - height + 1, 1)
+    if height < tip:
+        next = block_index.hash(height + 1, tip)
+        data['nextblockhash'] = next if next is not None else host.call('getblockhash', height + 1)
+    return data
+
+
+def stream_block(data, offset, limit):
+    # the header goes out first, then the transactions one by one, so the
+    # full JSON document never sits in memory
+    header = {k: v for k, v in data.items() if k != 'tx'}
+    header['tx_offset'] = offset
+    yield json.dumps(header)[:-1] + ', "tx": ['
+    for i, tx in enumerate(data['tx'][offset:offset + limit]):
+        yield (', ' if i > 0 else '') + json.dumps(tx)
+    yield ']}'
+
+
+def block_page(args, default_limit):
+    offset = args.get('offset')
+    limit = args.get('limit')
+    try:
+        offset = max(int(offset), 0)
+    except:
+        offset = 0
+    try:
+        limit = max(int(limit), 1)
+    except:
+        limit = default_limit
+    return offset, limit
 
 
 def block(height):
@@ -173,162 +513,206 @@ def block(height):
         return {'error': 'missing height'}
 
     try:
-        id = host.call('getblockhash', int(height))
-        data = host.call('getblock', id, 2)
+        tip_block = follower.get('block')
+        if tip_block is not None and tip_block['height'] == int(height):
+            return tip_block
+        data = fetch_block(height)
+    except RPCUnavailable:
+        raise
     except:
         data = {'error': 'unknown block'}
+        g.incomplete = True
     return data
 
 
 @app.route('/api/block', methods=['GET'])
 @limiter.exempt
+@conditional(block_validators)
 def api_block():
     height = request.args.get('height')
+    offset, limit = block_page(request.args, None)
     data = block(height)
-    return jsonify(data)
+    if 'tx' not in data:
+        return jsonify(data)
+    if limit is None:
+        limit = len(data['tx'])
+    return Response(stream_block(data, offset, limit), mimetype='application/json')
 
 
 @app.route('/block', methods=['GET'])
 @limiter.exempt
 def url_block():
+    elements = 50
     height = request.args.get('height')
+    offset, limit = block_page(request.args, elements)
     res_block = block(height)
+    txs = res_block.get('tx', [])
+    page = dict(res_block)
+    if 'tx' in page:
+        page['tx'] = txs[offset:offset + elements]
     data = {'block': height, 'result': json.dumps(
-        res_block, indent=4, sort_keys=True), 'transaction_list': res_block['tx']}
+        page, indent=4, sort_keys=True), 'transaction_list': page.get('tx', [])}
+    data['has_prev'] = offset > 0
+    data['prev'] = max(offset - elements, 0)
+    data['has_next'] = offset + elements < len(txs)
+    data['next'] = offset + elements
     return render_template('block', **data)
 
 
 def mempool():
-    data = host.call('getrawmempool')
-    return data
+    # the follower refreshes the tracker on every poll, requests only do
+    # it when the follower is not running; a down node serves the last view
+    if host.healthy():
+        mempool_tracker.ensure_fresh(explorerPollInterval)
+    return mempool_tracker
 
 
 @app.route('/api/mempool', methods=['GET'])
 @limiter.exempt
+@conditional(mempool_validators)
 def api_mempool():
-    data = mempool()
+    since = request.args.get('since')
+    offset = request.args.get('offset')
+    limit = request.args.get('limit')
+    tracker = mempool()
+
+    try:
+        if since is not None:
+            data = tracker.changes(int(since))
+        elif offset is not None or limit is not None:
+            offset = max(int(offset or 0), 0)
+            limit = min(max(int(limit or 1000), 1), 10000)
+            data = tracker.page(offset, limit)
+        else:
+            data = tracker.txids()
+    except ValueError:
+        data = {'error': 'since, offset and limit must be integers'}
     return jsonify(data)
 
 
 @app.route('/mempool', methods=['GET'])
 @limiter.exempt
 def url_mempool():
-    height = request.args.get('height')
-    mem = mempool()
-    data = {'transaction_list': mem}
+    elements = 500
+    offset = request.args.get('offset')
+
+    try:
+        offset = max(int(offset), 0)
+    except:
+        offset = 0
+
+    mem = mempool().page(offset, elements)
+    data = {'transaction_list': mem['txids'], 'total': mem['total'],
+            'first': offset + 1 if mem['total'] > 0 else 0,
+            'last': offset + len(mem['txids'])}
+    data['has_prev'] = offset > 0
+    data['prev'] = max(offset - elements, 0)
+    data['has_next'] = offset + elements < mem['total']
+    data['next'] = offset + elements
+    data['sequence'] = mem['sequence']
     return render_template('mempool', **data)
 
 
 def transaction(txid):
+    # returns the transaction already serialized as (json, pretty json)
     if txid is None:
-        return {'error': 'missing txid'}
-
-    if not len(txid) == 64:
-        return {'error': 'txid must be of length 64'}
-
-    try:
-        data = host.call('getrawtransaction', txid, True)
-    except:
-        data = {'error': 'unknown txid'}
-    return data
+        data = {'error': 'missing txid'}
+    elif not len(txid) == 64:
+        data = {'error': 'txid must be of length 64'}
+    else:
+        tip = tip_height()
+        cached = tx_cache.get(txid, tip)
+        if cached is not None:
+            return cached
+        try:
+            return tx_cache.put(txid, host.call('getrawtransaction', txid, True), tip)
+        except RPCUnavailable:
+            raise
+        except:
+            data = {'error': 'unknown txid'}
+    return json.dumps(data), json.dumps(data, indent=4, sort_keys=True)
 
 
 @app.route('/api/transaction', methods=['GET'])
 @limiter.exempt
+@conditional(transaction_validators)
 def api_transaction():
     txid = request.args.get('txid')
-    data = transaction(txid)
-    return jsonify(data)
+    data, pretty = transaction(txid)
+    return Response(data, mimetype='application/json')
 
 
 @app.route('/transaction', methods=['GET'])
 @limiter.exempt
 def url_transaction():
     txid = request.args.get('txid')
-    data = {'txid': txid, 'result': json.dumps(
-        transaction(txid), indent=4, sort_keys=True)}
+    data, pretty = transaction(txid)
+    data = {'txid': txid, 'result': pretty}
     return render_template('transaction', **data)
 
 
-def sync():
-    global last_update_or_tx
-    if time.time() - last_update_or_tx > 2:
-        update = client.full_scan(wollet)
-        wollet.apply_update(update)
-        last_update_or_tx = time.time()
+def balances():
+    # pages still render without the daemon, with zero balances
+    try:
+        return payouts.call('balance')
+    except Exception:
+        return {'balance': 0, 'balance_test': 0, 'balance_amp': 0}
+
+
+def addresses():
+    # return addresses never change, they are asked to the daemon once
+    global return_addresses
+    if return_addresses is None:
+        try:
+            return_addresses = payouts.call('addresses')
+        except Exception:
+            pass
+        if return_addresses is None:
+            return {'return_address': '', 'amp0_return_address': ''}
+    return return_addresses
 
 
 def faucet_asset(address, amount, asset):
+    if warming_up('lbtc'):
+        return {"success": False, "message": WARMING_UP, "warming_up": True}
     validate_res = host.call('validateaddress', address)
     if validate_res['isvalid']:
         # Call LWK
-        sync()
-        builder = network.tx_builder()
-        if validate_res['confidential_key'] == '':
-            builder.add_explicit_recipient(Address(address), amount, asset)
-        else:
-            builder.add_recipient(Address(address), amount, asset)
-        unsigned_pset = builder.finish(wollet)
-        signed_pset = signer.sign(unsigned_pset)
-
-        finalized_pset = wollet.finalize(signed_pset)
-        tx = finalized_pset.extract_tx()
-        txid = client.broadcast(tx)
-        wollet.apply_transaction(tx)
+        res = payouts.call('faucet', address, amount, asset,
+                           validate_res['confidential_key'] != '')
+        if 'ticket' in res:
+            message = "Payout of " + str(amount) + " sats to address " + \
+                address + " queued with ticket " + res['ticket'] + "."
+            return {"success": True, "message": message, "ticket": res['ticket']}
+        txid = res['txid']
         message = "Sent " + str(amount) + " sats to address " + \
-            address + " with transaction " + str(txid) + "."
-        return {"success": True, "message": message, "txid": str(txid)}
+            address + " with transaction " + txid + "."
+        return {"success": True, "message": message, "txid": txid}
     else:
         return {"success": False, "message": "Error"}
 
 
 def faucet_amp(gaid, amount):
-    result = requests.get(f'{ampUrl}gaids/{gaid}/validate', headers={
-                          'content-type': 'application/json', 'Authorization': f'token {ampToken}'}).json()
-    if not result['is_valid']:
-        return {"success": False, "message": "Invalid GAID"}
-    result = requests.get(f'{ampUrl}gaids/{gaid}/address', headers={
-                          'content-type': 'application/json', 'Authorization': f'token {ampToken}'}).json()
-    if result['error'] == '':
-        address = result['address']
-    else:
-        return {"success": False, "message": "Error in fetching address"}
-
-    # Update amp0 wallet
-    last_index = amp0.last_index()
-    update = amp0_client.full_scan_to_index(amp0_wollet, last_index)
-    amp0_wollet.apply_update(update)
-
-    # Create transaction
-    builder = network.tx_builder()
-    builder.add_recipient(Address(address), amount, amp0_assetid)
-    amp0pset = builder.finish_for_amp0(amp0_wollet)
-   
-    # Create the signer
-    amp0_signer = Signer(Mnemonic(amp0_mnemonic), network)
-    
-    # Sign with the user key
-    pset = amp0pset.pset()
-    pset = amp0_signer.sign(pset)
-
-    # Ask AMP0 to cosign
-    amp0pset = Amp0Pset(pset, amp0pset.blinding_nonces())
-    tx = amp0.sign(amp0pset)
-
-    # Broadcast
-    txid = amp0_client.broadcast(tx)
+    if warming_up('amp'):
+        return {"success": False, "message": WARMING_UP, "warming_up": True}
+    res = payouts.call('amp', gaid, amount)
+    if 'error' in res:
+        return {"success": False, "message": res['error']}
+    address = res['address']
+    txid = res['txid']
 
     message = "Sent " + str(amount) + " AMP ASSET to address " + \
-        address + " with transaction " + str(txid)  + "."
-    return {"success": True, "message": message, "txid": str(txid)}
+        address + " with transaction " + txid + "."
+    return {"success": True, "message": message, "txid": txid}
 
 
 @app.route('/api/faucet', methods=['GET'])
 @limiter.limit('1000/day;100/hour;3/minute',  on_breach=index_ratelimit_error_responder)
 def api_faucet():
-    balance_amp = amp0_wollet.balance().get(amp0_assetid, 0)
-    balance = wollet.balance().get(network.policy_asset(), 0)
-    balance_test = wollet.balance().get(assetid, 0)
+    b = balances()
+    balance_amp = b['balance_amp']
+    balance = b['balance']
+    balance_test = b['balance_test']
     address = request.args.get('address')
     asset = request.args.get('action')
     ip = request.headers.get('X-Forwarded-For', request.remote_addr)
@@ -345,30 +729,68 @@ def api_faucet():
             data = {'result': res['message'], 'balance': balance,
                     'balance_test': balance_test, 'balance_amp': balance_amp}
             if 'txid' in res: data['txid'] = res['txid']
+            if 'ticket' in res: data['ticket'] = res['ticket']
 
         elif asset == 'test':
             amount = 5000
             res = faucet_asset(address, amount, assetid)
             data = {'result_test': res['message'], 'balance': balance, 'balance_test': balance_test, 'balance_amp': balance_amp}
             if 'txid' in res: data['txid'] = res['txid']
+            if 'ticket' in res: data['ticket'] = res['ticket']
 
         elif asset == 'amp':
             amount = 1
             res = faucet_amp(address, amount)
             data = {'result_amp': res['message'], 'balance': balance, 'balance_test': balance_test, 'balance_amp': balance_amp}
             if 'txid' in res: data['txid'] = res['txid']
+        if res.get('warming_up'):
+            return unavailable_response(data)
         return jsonify(data)
     except Exception as e:
         data = {'result': 'error', 'error': str(e)}
         return jsonify(data)
 
 
+@app.route('/api/faucet/ticket', methods=['GET'])
+@limiter.exempt
+def api_faucet_ticket():
+    try:
+        status = payouts.call('ticket', request.args.get('id'))
+    except Exception as e:
+        return unavailable_response({'error': str(e)})
+    if status is None:
+        return jsonify({'error': 'unknown ticket'})
+    return jsonify(status)
+
+
+@app.route('/api/faucet/balance', methods=['GET'])
+@limiter.exempt
+def api_faucet_balance():
+    # an outage must not look like an empty faucet to monitoring
+    try:
+        r = jsonify(payouts.call('balance'))
+    except Exception as e:
+        return unavailable_response({'error': str(e)})
+    r.headers['Cache-Control'] = 'public, max-age=' + str(int(faucetSyncInterval))
+    return r
+
+
+@app.route('/api/faucet/sync', methods=['GET'])
+@limiter.exempt
+def api_faucet_sync():
+    try:
+        return jsonify(payouts.call('sync_status'))
+    except Exception as e:
+        return unavailable_response({'error': str(e)})
+
+
 @app.route('/faucet', methods=['GET'])
 @limiter.limit('1000/day;100/hour;3/minute')
 def url_faucet():
-    balance_amp = amp0_wollet.balance().get(amp0_assetid, 0)
-    balance = wollet.balance().get(network.policy_asset(), 0)
-    balance_test = wollet.balance().get(assetid, 0)
+    b = balances()
+    balance_amp = b['balance_amp']
+    balance = b['balance']
+    balance_test = b['balance_test']
     address = request.args.get('address')
     asset = request.args.get('action')
     ip = request.headers.get('X-Forwarded-For', request.remote_addr)
@@ -382,8 +804,7 @@ def url_faucet():
             data['form_amp'] = True
             data['assetid'] = assetid
             data['amp0_assetid'] = amp0_assetid
-            data['return_address'] = return_address
-            data['amp0_return_address'] = amp0_return_address
+            data.update(addresses())
             return render_template('faucet', **data)
 
         if asset == 'lbtc':
@@ -411,8 +832,7 @@ def url_faucet():
 
         data['assetid'] = assetid
         data['amp0_assetid'] = amp0_assetid
-        data['return_address'] = return_address
-        data['amp0_return_address'] = amp0_return_address
+        data.update(addresses())
         return render_template('faucet', **data)
     except Exception as e:
         data = {'result': 'error ' + str(e), 'balance': balance,
@@ -422,47 +842,13 @@ def url_faucet():
         data['form_amp'] = True
         data['assetid'] = assetid
         data['amp0_assetid'] = amp0_assetid
-        data['return_address'] = return_address
-        data['amp0_return_address'] = amp0_return_address
+        data.update(addresses())
         return render_template('faucet', **data)
 
 
 def issuer(asset_amount, asset_address, token_amount, token_address, issuer_pubkey, name, ticker, precision, domain):
-    data = {}
-    version = 0  # don't change
-    blind = False
-
-    # Convert amount in satoshi
-    asset_amount = int(asset_amount) * 10 ** int(precision)
-
-    # Call LWK
-    sync()
-
-    contract = Contract(domain=domain, issuer_pubkey=issuer_pubkey,
-                        name=name, precision=int(precision), ticker=ticker, version=version)
-    issued_asset = asset_amount
-    reissuance_tokens = token_amount
-    builder = network.tx_builder()
-    builder.issue_asset(int(issued_asset), Address(asset_address),
-                        int(reissuance_tokens), Address(token_address), contract)
-    unsigned_pset = builder.finish(wollet)
-    signed_pset = signer.sign(unsigned_pset)
-    finalized_pset = wollet.finalize(signed_pset)
-    tx = finalized_pset.extract_tx()
-    txid = client.broadcast(tx)
-    wollet.apply_transaction(tx)
-
-    asset_id = signed_pset.inputs()[0].issuance_asset()
-    token_id = signed_pset.inputs()[0].issuance_token()
-
-    data['contract'] = str(contract)
-    data['asset_id'] = str(asset_id)
-    data['token_id'] = str(token_id)
-    data['txid'] = str(txid)
-    data['registry'] = json.dumps(
-        {'asset_id': data['asset_id'], 'contract': json.loads(data['contract'])})
-
-    return data
+    return payouts.call('issue', asset_amount, asset_address, token_amount,
+                        token_address, issuer_pubkey, name, ticker, precision, domain)
 
 
 @app.route('/api/issuer', methods=['GET'])
@@ -470,6 +856,8 @@ def issuer(asset_amount, asset_address, token_amount, token_address, issuer_pubk
 def api_issuer():
     ip = request.headers.get('X-Forwarded-For', request.remote_addr)
     command = request.args.get('command')
+    if command == 'asset' and warming_up('issue'):
+        return unavailable_response({'error': WARMING_UP})
     if command == 'asset':
         asset_amount = int(request.args.get('asset_amount'))
         asset_address = request.args.get('asset_address')
@@ -489,11 +877,65 @@ def api_issuer():
     return jsonify(data)
 
 
+BULK_FIELDS = ('name', 'ticker', 'precision', 'domain', 'pubkey',
+               'asset_amount', 'asset_address', 'token_amount', 'token_address')
+
+
+def bulk_contracts(body):
+    # a list of contracts, bare or as {"contracts": [...]}
+    contracts = body.get('contracts') if isinstance(body, dict) else body
+    if not isinstance(contracts, list) or len(contracts) == 0:
+        raise Exception('expected a non empty list of contracts')
+    if len(contracts) > faucetBulkIssueMax:
+        raise Exception('at most ' + str(faucetBulkIssueMax) + ' contracts per request')
+    for i, c in enumerate(contracts):
+        if not isinstance(c, dict):
+            raise Exception('contract ' + str(i) + ' is not an object')
+        missing = [f for f in BULK_FIELDS if f not in c]
+        if len(missing) > 0:
+            raise Exception('contract ' + str(i) + ' misses ' + ', '.join(missing))
+        for f in ('asset_amount', 'token_amount', 'precision'):
+            if not isinstance(c[f], int) or c[f] < 0:
+                raise Exception('contract ' + str(i) + ' has an invalid ' + f)
+        if c['precision'] > 8:
+            raise Exception('contract ' + str(i) + ' has an invalid precision')
+    return [{f: c[f] for f in BULK_FIELDS} for c in contracts]
+
+
+@app.route('/api/issuer/bulk', methods=['POST'])
+@limiter.limit('1000/day;100/hour;3/minute',  on_breach=index_ratelimit_error_responder)
+def api_issuer_bulk():
+    try:
+        contracts = bulk_contracts(request.get_json(force=True, silent=True))
+    except Exception as e:
+        r = jsonify({'error': str(e)})
+        r.status_code = 400
+        return r
+    if warming_up('issue'):
+        return unavailable_response({'error': WARMING_UP})
+    # the assets are issued in parallel by the daemon, the timeout still
+    # allows for every one of them taking its own sync and broadcast
+    client = PayoutClient(faucetSocket, 2 * rpcTimeout * (1 + len(contracts)))
+    try:
+        results = client.call('issue_many', contracts)
+    except Exception as e:
+        r = jsonify({'error': str(e)})
+        r.status_code = 500
+        return r
+    for c, data in zip(contracts, results):
+        data['domain'] = c['domain']
+        data['name'] = c['name']
+    issued = len([data for data in results if 'error' not in data])
+    return jsonify({'assets': results, 'issued': issued, 'failed': len(results) - issued})
+
+
 @app.route('/issuer', methods=['GET'])
 @limiter.limit('1000/day;100/hour;3/minute')
 def url_issuer():
     ip = request.headers.get('X-Forwarded-For', request.remote_addr)
     command = request.args.get('command')
+    if command == 'asset' and warming_up('issue'):
+        return render_template('issuer', form=True, result=WARMING_UP), 503
     if command == 'asset':
         asset_amount = int(request.args.get('asset_amount'))
         asset_address = request.args.get('asset_address')
@@ -549,6 +991,63 @@ def api_utils():
     return jsonify(data)
 
 
+def submit_transactions(items, send):
+    # a single RPC batch tests every transaction and package, a second one
+    # sends the accepted ones, a package parents first
+    tested = host.batch([('testmempoolaccept', item if isinstance(item, list) else [item])
+                         for item in items])
+    results = []
+    accepted = []
+    for item, test in zip(items, tested):
+        if test['error'] is not None:
+            results.append({'error': test['error']})
+            continue
+        result = {'result_test': test['result']}
+        results.append(result)
+        if send and all([t.get('allowed') is True for t in test['result']]):
+            accepted.append((result, item if isinstance(item, list) else [item]))
+    if len(accepted) > 0:
+        sent = host.batch([('sendrawtransaction', tx) for result, txs in accepted for tx in txs])
+        i = 0
+        for result, txs in accepted:
+            result['result_broadcast'] = sent[i:i + len(txs)]
+            i += len(txs)
+    return results
+
+
+@app.route('/api/utils', methods=['POST'])
+@limiter.exempt
+def api_utils_batch():
+    # many transactions or packages in one body, as a JSON array or one per
+    # line, tested and sent utils batch_size at a time while the body is read
+    command = request.args.get('command')
+    if command not in ('test', 'broadcast'):
+        r = jsonify({'error': 'command must be test or broadcast'})
+        r.status_code = 400
+        return r
+    results = []
+    items = []
+    count = 0
+    try:
+        for item in read_transactions(request.stream):
+            count += len(item) if isinstance(item, list) else 1
+            if count > utilsMaxTransactions:
+                raise Exception('at most ' + str(utilsMaxTransactions) + ' transactions per request')
+            items.append(item)
+            if len(items) == utilsBatchSize:
+                results += submit_transactions(items, command == 'broadcast')
+                items = []
+        results += submit_transactions(items, command == 'broadcast')
+    except RPCUnavailable:
+        raise
+    except Exception as e:
+        # what was already sent is reported along with the error
+        r = jsonify({'error': str(e), 'results': results})
+        r.status_code = 400
+        return r
+    return jsonify({'results': results})
+
+
 @app.route('/utils', methods=['GET'])
 @limiter.limit('1000/day;100/hour;3/minute')
 def url_utils():
@@ -599,56 +1098,84 @@ def api_about():
 @app.route('/about', methods=['GET'])
 @limiter.exempt
 def url_about():
+    page = templates.cached('about')
+    if page is not None:
+        return page
     data = about()
-    return render_template('about', **data)
+    return render_template('about', 'about', **data)
+
+
+follower.publish('stats', stats_snapshot.refresh)
+follower.publish('explorer', explorer_page)
+follower.publish('block', lambda: fetch_block(follower.info['blocks']))
+follower.publish('mempool', mempool_tracker.refresh, every_poll=True)
+
+
+def publish_events(changed):
+    # event ids are the height and the node mempool sequence, the same in
+    # every worker process, then the event kind
+    info = follower.info
+    sequence = mempool_tracker.sequence
+    if changed:
+        # the new blocks, or just the tip after a reorg at the same height
+        page = follower.get('explorer')
+        blocks = page['blocks_list'][:10] if page is not None else []
+        if feed_state['height'] is not None:
+            blocks = [b for b in blocks if b['id'] > feed_state['height']] or blocks[:1]
+        feed.publish('tip', (info['blocks'], sequence, 0),
+                     {'height': info['blocks'], 'hash': info['bestblockhash'], 'blocks': blocks})
+        feed_state['height'] = info['blocks']
+    stats = follower.get('stats')
+    if stats is not None and stats is not feed_state['stats']:
+        feed.publish('stats', (info['blocks'], sequence, 1), stats)
+        feed_state['stats'] = stats
+    since = feed_state['sequence']
+    if since is not None and sequence != since:
+        data = mempool_tracker.changes(since)
+        if not data['reset']:
+            data['since'] = since
+            data['total'] = len(mempool_tracker.txids())
+            # a request may have refreshed the mempool in the meantime
+            sequence = data['sequence']
+            feed.publish('mempool', (info['blocks'], sequence, 2), data)
+    feed_state['sequence'] = sequence
+
+
+follower.listen(publish_events)
+
+
+@app.route('/api/events', methods=['GET'])
+@limiter.exempt
+def api_events():
+    # tip, stats and mempool events as Server-Sent Events
+    if feed.full():
+        r = jsonify({'error': 'too many listeners'})
+        r.status_code = 503
+        r.headers['Retry-After'] = str(int(eventsKeepalive))
+        return r
+    r = Response(feed.subscribe(parse_id(request.headers.get('Last-Event-ID'))), mimetype='text/event-stream')
+    r.headers['Cache-Control'] = 'no-cache'
+    # a buffering proxy would hold the events back
+    r.headers['X-Accel-Buffering'] = 'no'
+    return r
+
+
+@app.before_request
+def start_follower():
+    # every worker process runs its own follower, started on first use so
+    # it is not lost when a server forks the workers after importing the app
+    follower.start()
+    if rpc_pool is not None:
+        rpc_pool.start()
+    if worker_metrics is not None:
+        worker_metrics.start()
 
 
 if __name__ == '__main__':
-    mnemonic = Mnemonic(str(lwkMnemonic))
-    network = Network.testnet()
-    b = EsploraClientBuilder(
-        base_url="https://waterfalls.liquidwebwallet.org/liquidtestnet/api",
-        network=network,
-        waterfalls=True,
-        utxo_only=True,
-    )
-    client = EsploraClient.from_builder(b)
-
-    signer = Signer(mnemonic, network)
-    desc = signer.wpkh_slip77_descriptor()
-
-    wollet = Wollet(network, desc, datadir="./.lwk_data")
-    update = client.full_scan(wollet)
-    wollet.apply_update(update)
-    # here we initialize a global variable (since we're in "main")
-    # that will be updated later
-    last_update_or_tx = time.time()
-
-    return_address = str(wollet.address(1).address())
-
-    print(wollet.balance())
-
-    # amp0 wallet
-    amp_id = ""
-    amp0 = Amp0(network, amp0_user, amp0_password, amp_id)
-
-    amp0_desc =  amp0.wollet_descriptor()
-    amp0_wollet = Wollet(network, amp0_desc, datadir='./.lwk_data_amp0')
-    b2 = EsploraClientBuilder(
-        base_url="https://waterfalls.liquidwebwallet.org/liquidtestnet/api",
-        network=network,
-        waterfalls=True,
-        utxo_only=True,
-    )
-    amp0_client = EsploraClient.from_builder(b2)
-    last_index = amp0.last_index()
-    update = amp0_client.full_scan_to_index(amp0_wollet, last_index)
-    amp0_wollet.apply_update(update)
-
-    amp0_return_address = str(amp0.address(1).address())
-
-    print(amp0_wollet.balance())
-
-    # Start app
-    app.import_name = '.'
+    # Start the chain follower and the app
+    follower.start()
+    if rpc_pool is not None:
+        rpc_pool.start()
+    if worker_metrics is not None:
+        worker_metrics.start()
     app.run(host='0.0.0.0', port=8123)
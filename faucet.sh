@@ -6,5 +6,6 @@ sysctl -w net.ipv6.conf.default.disable_ipv6=1
 sysctl -w net.ipv6.conf.tun0.disable_ipv6=1
 
 . venv3/bin/activate
+python payout_daemon.py &
 python faucet.py
 deactivate
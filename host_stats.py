@@ -0,0 +1,65 @@
+#    MIT License - Valerio Vaccaro
+#    Host statistics read without spawning processes
+
+import os
+import threading
+import time
+
+# the kernel does not change under a running process
+_uname = ' '.join(os.uname())
+
+
+def uname():
+    return _uname
+
+
+def uptime():
+    # same information printed by the uptime command
+    try:
+        with open('/proc/uptime') as f:
+            seconds = int(float(f.read().split()[0]))
+    except (OSError, ValueError, IndexError):
+        seconds = None
+    load = os.getloadavg()
+
+    up = ''
+    if seconds is not None:
+        days, seconds = divmod(seconds, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        up = 'up '
+        if days > 0:
+            up += str(days) + (' day, ' if days == 1 else ' days, ')
+        up += '%d:%02d, ' % (hours, seconds // 60)
+    return time.strftime('%H:%M:%S') + ' ' + up + \
+        'load average: %.2f, %.2f, %.2f' % load
+
+
+class StatsSnapshot(object):
+    def __init__(self, producer, ttl=10):
+        self._producer = producer
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._updated = 0
+
+    def refresh(self):
+        value = self._producer()
+        self._value = value
+        self._updated = time.time()
+        return value
+
+    def get(self):
+        # warm reads only look at the cached dict, a single caller
+        # refreshes it once the ttl has expired
+        if self._value is not None and time.time() - self._updated < self._ttl:
+            return self._value
+        with self._lock:
+            if self._value is not None and time.time() - self._updated < self._ttl:
+                return self._value
+            try:
+                return self.refresh()
+            except Exception:
+                # keep serving the last snapshot while the node is down
+                if self._value is None:
+                    raise
+                return self._value
@@ -0,0 +1,46 @@
+#    MIT License - Valerio Vaccaro
+#    Conditional GET support for the read endpoints
+
+import functools
+from flask import Response, g, make_response, request
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def short(max_age):
+    return 'public, max-age=' + str(int(max_age))
+
+
+def conditional(validator):
+    # validator() returns (etag, cache_control, last_modified or None), or
+    # None when there is no cheap way to tell the content is unchanged; a
+    # matching If-None-Match is answered before the view runs at all; views
+    # set g.incomplete when their answer must not be cached
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            validators = validator()
+            if validators is None:
+                return f(*args, **kwargs)
+            etag, cache_control, last_modified = validators
+
+            if request.if_none_match:
+                unchanged = request.if_none_match.contains(etag)
+            else:
+                unchanged = last_modified is not None and \
+                    request.if_modified_since is not None and \
+                    request.if_modified_since.timestamp() >= int(last_modified)
+            if unchanged:
+                r = Response(status=304)
+            else:
+                r = make_response(f(*args, **kwargs))
+                if r.status_code >= 400 or g.get('incomplete'):
+                    r.headers['Cache-Control'] = 'no-cache'
+                    return r
+            r.set_etag(etag)
+            r.headers['Cache-Control'] = cache_control
+            if last_modified is not None:
+                r.last_modified = int(last_modified)
+            return r
+        return wrapper
+    return decorator
@@ -0,0 +1,100 @@
+#    MIT License - Valerio Vaccaro
+#    In-memory view of the node mempool with a change log for cheap polling
+
+import collections
+import threading
+import time
+from bitcoin_rpc_class import RPCError
+
+# codes of a node rejecting the mempool_sequence argument: the usage text of
+# older nodes, a wrong type or an invalid parameter
+PARAMETER_ERRORS = (-1, -3, -8)
+
+
+class MempoolTracker(object):
+    def __init__(self, host, history=1000):
+        self._host = host
+        self._lock = threading.Lock()
+        self._txids = []
+        self._set = set()
+        # (previous, sequence, added, removed) for every refresh that changed
+        # something
+        self._log = collections.deque(maxlen=history)
+        self._node_sequence = None
+        self.sequence = 0
+        self.updated = 0
+
+    def _fetch(self):
+        # mempool_sequence lets the node number the changes for us, older
+        # nodes only return the list and the sequence is kept locally
+        if self._node_sequence is not False:
+            try:
+                res = self._host.call('getrawmempool', False, True)
+                self._node_sequence = True
+                return res['txids'], res['mempool_sequence']
+            except RPCError as e:
+                # only a rejected argument means an older node, anything
+                # else (a node still warming up, a lost connection) is
+                # raised and the sequence is tried again next time
+                if self._node_sequence is True or e.code not in PARAMETER_ERRORS:
+                    raise
+                self._node_sequence = False
+        return self._host.call('getrawmempool'), None
+
+    def refresh(self):
+        with self._lock:
+            txids, sequence = self._fetch()
+            current = set(txids)
+            added = [t for t in txids if t not in self._set]
+            removed = [t for t in self._txids if t not in current]
+            if len(added) > 0 or len(removed) > 0:
+                if sequence is None or sequence <= self.sequence:
+                    sequence = self.sequence + 1
+                # new transactions go at the end so pages stay stable
+                self._txids = [t for t in self._txids if t in current] + added
+                self._set = current
+                self._log.append((self.sequence, sequence, added, removed))
+                self.sequence = sequence
+            self.updated = time.time()
+        return self._txids
+
+    def ensure_fresh(self, max_age):
+        if time.time() - self.updated > max_age:
+            self.refresh()
+
+    def txids(self):
+        return self._txids
+
+    def page(self, offset, limit):
+        txids = self._txids
+        return {'sequence': self.sequence, 'total': len(txids), 'offset': offset,
+                'txids': txids[offset:offset + limit]}
+
+    def changes(self, since):
+        # txids added and removed after sequence since; when the log no
+        # longer reaches back that far the client gets the full list
+        log = list(self._log)
+        published = set([entry[1] for entry in log] + [log[0][0] if len(log) > 0 else 0])
+        # the node numbers its mempool for every worker process, a sequence
+        # seen by another one is covered by the entries around it; the
+        # changes may then repeat some the client already has
+        covered = self._node_sequence is True and len(log) > 0 and log[0][0] <= since <= self.sequence
+        if since != self.sequence and since not in published and not covered:
+            return {'sequence': self.sequence, 'reset': True, 'txids': self._txids}
+        added = collections.OrderedDict()
+        removed = collections.OrderedDict()
+        for previous, sequence, a, r in log:
+            if sequence <= since:
+                continue
+            for t in r:
+                if t in added:
+                    del added[t]
+                else:
+                    removed[t] = True
+            for t in a:
+                if t in removed:
+                    del removed[t]
+                else:
+                    added[t] = True
+        return {'sequence': self.sequence, 'reset': False,
+                'added': list(added), 'removed': list(removed)}
@@ -0,0 +1,239 @@
+#    MIT License - Valerio Vaccaro
+#    In-process counters and histograms exported in the Prometheus text format
+
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if len(pairs) > 0 else ''
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self._labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [self.name + _labels(self._labels, k) + ' ' + repr(float(v)) for k, v in values]
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self._labels = labels
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [per bucket counts, sum]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self._buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(e[0]), e[1]) for k, e in self._values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self._buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(self.name + '_bucket' +
+                             _labels(self._labels, labels, 'le="%s"' % bound) +
+                             ' ' + str(cumulative))
+            lines.append(self.name + '_sum' + _labels(self._labels, labels) + ' ' + repr(total))
+            lines.append(self.name + '_count' + _labels(self._labels, labels) + ' ' + str(cumulative))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self):
+        # [name, type, help, sample lines] for every metric with samples,
+        # plain lists so they can travel as JSON between processes
+        families = []
+        for m in self._metrics:
+            samples = m.samples()
+            if len(samples) > 0:
+                families.append([m.name, m.type, m.help, samples])
+        return families
+
+    def render(self, extra=(), local=True):
+        # families collected by another process are merged into ours, so a
+        # single scrape covers the web workers and the payout daemon
+        merged = {}
+        own = self.collect() if local else []
+        for name, type, help, samples in list(own) + list(extra):
+            if name in merged:
+                merged[name][2] = merged[name][2] + samples
+            else:
+                merged[name] = [type, help, samples]
+        lines = []
+        for name, (type, help, samples) in merged.items():
+            lines.append('# HELP ' + name + ' ' + help)
+            lines.append('# TYPE ' + name + ' ' + type)
+            lines += samples
+        return '\n'.join(lines) + '\n'
+
+
+def _relabel(sample, label):
+    name, value = sample.rsplit(' ', 1)
+    if '{' in name:
+        return name.replace('{', '{' + label + ',', 1) + ' ' + value
+    return name + '{' + label + '} ' + value
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkerFiles(object):
+    def __init__(self, registry, directory, interval=5):
+        # every worker process replaces its own file with its collected
+        # families, a scrape answered by any worker reads all of them
+        self._registry = registry
+        self._directory = directory
+        self._interval = interval
+        self._start_lock = threading.Lock()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def dump(self):
+        path = os.path.join(self._directory, str(os.getpid()) + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._registry.collect(), f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        # samples get a worker label, files of exited workers are removed
+        self.dump()
+        families = []
+        for name in os.listdir(self._directory):
+            if not name.endswith('.json'):
+                continue
+            pid = int(name[:-len('.json')])
+            path = os.path.join(self._directory, name)
+            if not _alive(pid):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    collected = json.load(f)
+            except (OSError, ValueError):
+                continue
+            label = 'worker="%d"' % pid
+            for family, type, help, samples in collected:
+                families.append([family, type, help, [_relabel(s, label) for s in samples]])
+        return families
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.dump()
+            except Exception as e:
+                print('Metrics dump failed: ' + str(e))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+
+registry = Registry()
+
+RPC_SECONDS = registry.histogram('rpc_duration_seconds', 'Duration of node RPC calls.',
+                                 ('method',))
+RPC_RETRIES = registry.counter('rpc_retries_total', 'Node RPC calls retried after a connection error.',
+                               ('method',))
+RPC_ERRORS = registry.counter('rpc_errors_total', 'Node RPC calls that failed.',
+                              ('method', 'kind'))
+STAGE_SECONDS = registry.histogram('faucet_stage_duration_seconds',
+                                   'Duration of the payout and issuance stages.', ('stage',))
+STAGE_ERRORS = registry.counter('faucet_stage_errors_total',
+                                'Payout and issuance stages that failed.', ('stage',))
+CACHE_REQUESTS = registry.counter('cache_requests_total', 'Cache lookups by result.',
+                                  ('cache', 'result'))
+HTTP_SECONDS = registry.histogram('http_request_duration_seconds',
+                                  'Duration of HTTP requests by route.', ('route',))
+
+
+@contextlib.contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
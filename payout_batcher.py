@@ -0,0 +1,120 @@
+#    MIT License - Valerio Vaccaro
+#    Coalesces faucet payouts into a single transaction
+
+import threading
+import time
+import uuid
+from wallet_coordinator import BroadcastError
+
+
+class Ticket(object):
+    def __init__(self, recipient):
+        self.id = uuid.uuid4().hex
+        self.recipient = recipient
+        self.created = time.time()
+        self.txid = None
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, txid=None, error=None):
+        self.txid = txid
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        # returns the txid, None if still queued after timeout
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.txid
+
+    def status(self):
+        if not self._done.is_set():
+            status = 'pending'
+        elif self.error is not None:
+            status = 'failed'
+        else:
+            status = 'sent'
+        data = {'ticket': self.id, 'status': status}
+        if self.txid is not None:
+            data['txid'] = self.txid
+        if self.error is not None:
+            data['error'] = str(self.error)
+        return data
+
+
+class PayoutBatcher(object):
+    def __init__(self, send, window=2, max_recipients=20, ticket_ttl=3600):
+        # send takes a list of recipients and returns the txid paying all of them
+        self._send = send
+        self._window = window
+        self._max_recipients = max_recipients
+        self._ticket_ttl = ticket_ttl
+        self._queue = []
+        self._tickets = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, recipient):
+        ticket = Ticket(recipient)
+        with self._cond:
+            self._queue.append(ticket)
+            self._tickets[ticket.id] = ticket
+            self._cond.notify()
+        return ticket
+
+    def ticket(self, id):
+        return self._tickets.get(id)
+
+    def _prune(self):
+        expired = time.time() - self._ticket_ttl
+        for id in [id for id, t in self._tickets.items() if t.created < expired]:
+            del self._tickets[id]
+
+    def _next_batch(self):
+        # wait for a first request, then keep collecting until the window
+        # closes or the transaction is full
+        with self._cond:
+            while len(self._queue) == 0:
+                self._cond.wait()
+            closes = self._queue[0].created + self._window
+            while len(self._queue) < self._max_recipients:
+                remaining = closes - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self._max_recipients]
+            self._queue = self._queue[self._max_recipients:]
+            self._prune()
+        return batch
+
+    def _pay(self, batch):
+        try:
+            txid = self._send([t.recipient for t in batch])
+        except BroadcastError as e:
+            # the transaction may still confirm, paying the recipients one
+            # by one could pay them twice
+            print('Batch payout not retried: ' + str(e))
+            for t in batch:
+                t.resolve(txid=e.txid, error=e)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].resolve(error=e)
+                return
+            # one bad recipient must not fail everybody else in the batch
+            print('Batch payout failed, paying recipients one by one: ' + str(e))
+            for t in batch:
+                self._pay([t])
+            return
+        for t in batch:
+            t.resolve(txid=txid)
+
+    def _run(self):
+        while True:
+            self._pay(self._next_batch())
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
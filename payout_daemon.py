@@ -0,0 +1,283 @@
+#    MIT License - Valerio Vaccaro
+#    Payout daemon, the only process holding the wallets and the signers
+
+import concurrent.futures
+import configparser
+import json
+import threading
+import time
+from lwk import *
+from payout_batcher import PayoutBatcher
+from payout_ipc import PayoutServer
+from wallet_coordinator import WalletCoordinator
+from amp_payout import AmpPayout
+from metrics import registry, stage
+
+
+WARMING_UP = 'warming up'
+
+
+class PayoutService(object):
+    # served over the socket, attach_* and failed belong to the startup threads
+    METHODS = ('faucet', 'ticket', 'amp', 'issue', 'issue_many', 'balance', 'sync_status',
+               'status', 'addresses', 'metrics')
+
+    def __init__(self, network, assetid, amp0_assetid,
+                 batch_window=0, batch_size=20, batch_wait=30, issue_concurrency=8):
+        # the wallets are attached by the startup threads, the socket is
+        # served from the start and answers 'warming up' until then
+        self._network = network
+        self._coordinator = None
+        self._amp_payout = None
+        self._errors = {}
+        self._assetid = assetid
+        self._amp0_assetid = amp0_assetid
+        self._batch_wait = batch_wait
+        self._issue_concurrency = issue_concurrency
+        # payouts are coalesced only when a batching window is configured
+        self._batcher = None
+        if batch_window > 0:
+            self._batcher = PayoutBatcher(self._send_payouts, batch_window, batch_size)
+            self._batcher.start()
+        self._addresses = {'return_address': '', 'amp0_return_address': ''}
+
+    def attach_wallet(self, coordinator, return_address):
+        self._addresses['return_address'] = return_address
+        self._coordinator = coordinator
+
+    def attach_amp(self, amp_payout, return_address):
+        self._addresses['amp0_return_address'] = return_address
+        self._amp_payout = amp_payout
+
+    def failed(self, name, error):
+        self._errors[name] = error
+
+    def _ready(self, wallet):
+        # loaded from the datadir is not enough, payouts wait for the first
+        # sync so they never spend coins already spent before a restart
+        return wallet is not None and wallet.synced_at > 0
+
+    def _require(self, wallet):
+        if not self._ready(wallet):
+            raise Exception(WARMING_UP)
+
+    def _send_payouts(self, recipients):
+        # one transaction paying every (address, amount, asset, confidential)
+        with stage('faucet'):
+            self._coordinator.ensure_synced()
+            return self._coordinator.pay(recipients)
+
+    def faucet(self, address, amount, asset, confidential):
+        # returns the txid, or a ticket when the batch is still queued
+        self._require(self._coordinator)
+        recipient = (address, amount, asset, confidential)
+        if self._batcher is None:
+            return {'txid': self._send_payouts([recipient])}
+        ticket = self._batcher.submit(recipient)
+        txid = ticket.wait(self._batch_wait)
+        if txid is None:
+            return {'ticket': ticket.id}
+        return {'txid': txid}
+
+    def ticket(self, id):
+        ticket = self._batcher.ticket(id) if self._batcher is not None else None
+        return ticket.status() if ticket is not None else None
+
+    def amp(self, gaid, amount):
+        self._require(self._amp_payout)
+        if not self._amp_payout.validate(gaid):
+            return {'error': 'Invalid GAID'}
+        address = self._amp_payout.address(gaid)
+        if address is None:
+            return {'error': 'Error in fetching address'}
+        with stage('amp'):
+            return {'address': address, 'txid': self._amp_payout.pay(address, amount)}
+
+    def issue(self, asset_amount, asset_address, token_amount, token_address,
+              issuer_pubkey, name, ticker, precision, domain):
+        data = {}
+        version = 0  # don't change
+
+        # Convert amount in satoshi
+        asset_amount = int(asset_amount) * 10 ** int(precision)
+
+        self._require(self._coordinator)
+        self._coordinator.ensure_synced()
+
+        contract = Contract(domain=domain, issuer_pubkey=issuer_pubkey,
+                            name=name, precision=int(precision), ticker=ticker, version=version)
+
+        def build(builder):
+            builder.issue_asset(int(asset_amount), Address(asset_address),
+                                int(token_amount), Address(token_address), contract)
+
+        with stage('issue'):
+            txid, signed_pset = self._coordinator.transact(build, {})
+
+        data['contract'] = str(contract)
+        data['asset_id'] = str(signed_pset.inputs()[0].issuance_asset())
+        data['token_id'] = str(signed_pset.inputs()[0].issuance_token())
+        data['txid'] = str(txid)
+        data['registry'] = json.dumps(
+            {'asset_id': data['asset_id'], 'contract': json.loads(data['contract'])})
+        return data
+
+    def issue_many(self, contracts):
+        # LWK takes a single issuance per transaction, so every asset gets
+        # its own; they run in parallel, each over its own pre-split coin,
+        # and one failing contract does not stop the others
+        self._require(self._coordinator)
+        self._coordinator.ensure_synced()
+
+        def issue(c):
+            try:
+                return self.issue(c['asset_amount'], c['asset_address'], c['token_amount'],
+                                  c['token_address'], c['pubkey'], c['name'], c['ticker'],
+                                  c['precision'], c['domain'])
+            except Exception as e:
+                return {'error': str(e)}
+
+        workers = max(1, min(self._issue_concurrency, len(contracts)))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(issue, contracts))
+
+    def balance(self):
+        # balances come from the datadir state until the first sync
+        coordinator = self._coordinator
+        amp_payout = self._amp_payout
+        balance = coordinator.balance if coordinator is not None else {}
+        balance_amp = amp_payout.balance if amp_payout is not None else {}
+        return {'balance': balance.get(self._network.policy_asset(), 0),
+                'balance_test': balance.get(self._assetid, 0),
+                'balance_amp': balance_amp.get(self._amp0_assetid, 0)}
+
+    def sync_status(self):
+        if self._coordinator is None:
+            return {'height': None, 'time': 0, 'stale': True}
+        return self._coordinator.sync_status()
+
+    def _status(self, name, wallet):
+        if wallet is None:
+            state = 'loading'
+        elif wallet.synced_at == 0:
+            state = 'syncing'
+        else:
+            state = 'ready'
+        status = {'ready': state == 'ready', 'state': state}
+        if name in self._errors and state != 'ready':
+            status['error'] = self._errors[name]
+        return status
+
+    def status(self):
+        return {'lwk': self._status('lwk', self._coordinator),
+                'amp0': self._status('amp0', self._amp_payout)}
+
+    def addresses(self):
+        if self._coordinator is None or self._amp_payout is None:
+            return None
+        return self._addresses
+
+    def metrics(self):
+        return registry.collect()
+
+
+def warm_up(service, name, start, interval):
+    # retried until it succeeds, the payouts of that wallet are refused
+    # with 'warming up' meanwhile
+    while True:
+        try:
+            start()
+            return
+        except Exception as e:
+            print('Starting the ' + name + ' wallet failed: ' + str(e))
+            service.failed(name, str(e))
+            time.sleep(interval)
+
+
+def main():
+    config = configparser.RawConfigParser()
+    config.read('liquid.conf')
+
+    ampUrl = config.get('AMP', 'url')
+    ampToken = config.get('AMP', 'token')
+    ampGaidTTL = config.getfloat('AMP', 'gaid_ttl', fallback=300)
+
+    amp0_user = config.get('GDK', 'amp0_user')
+    amp0_password = config.get('GDK', 'amp0_password')
+    amp0_assetid = config.get('GDK', 'amp0_assetid')
+    amp0_mnemonic = config.get('GDK', 'mnemonic')
+
+    faucetSocket = config.get('FAUCET', 'socket', fallback='./.payout.sock')
+    faucetBatchWindow = config.getfloat('FAUCET', 'batch_window', fallback=0)
+    faucetBatchSize = config.getint('FAUCET', 'batch_size', fallback=20)
+    faucetBatchWait = config.getfloat('FAUCET', 'batch_wait', fallback=30)
+    faucetCoinPool = config.getint('FAUCET', 'coin_pool', fallback=50)
+    faucetSplitAmount = config.getint('FAUCET', 'split_amount', fallback=200000)
+    faucetSplitAmountTest = config.getint('FAUCET', 'split_amount_test', fallback=50000)
+    faucetFeeMargin = config.getint('FAUCET', 'fee_margin', fallback=2000)
+    faucetPoolInterval = config.getfloat('FAUCET', 'pool_interval', fallback=30)
+    faucetSyncInterval = config.getfloat('FAUCET', 'sync_interval', fallback=10)
+    faucetMaxStale = config.getfloat('FAUCET', 'max_stale', fallback=60)
+    faucetIssueConcurrency = config.getint('FAUCET', 'issue_concurrency', fallback=8)
+
+    lwkMnemonic = config.get('LWK', 'mnemonic')
+    assetid = config.get('LWK', 'assetid')
+
+    network = Network.testnet()
+    service = PayoutService(network, assetid, amp0_assetid,
+                            faucetBatchWindow, faucetBatchSize, faucetBatchWait,
+                            faucetIssueConcurrency)
+
+    def start_wallet():
+        signer = Signer(Mnemonic(str(lwkMnemonic)), network)
+        b = EsploraClientBuilder(
+            base_url="https://waterfalls.liquidwebwallet.org/liquidtestnet/api",
+            network=network,
+            waterfalls=True,
+            utxo_only=True,
+        )
+        client = EsploraClient.from_builder(b)
+        # the wallet state persisted in the datadir is loaded without any
+        # network access, the background sync only fetches what is new
+        wollet = Wollet(network, signer.wpkh_slip77_descriptor(), datadir="./.lwk_data")
+        # every access to the wallet goes through the coordinator, which also
+        # keeps a pool of pre-split coins for parallel payouts
+        coordinator = WalletCoordinator(network, wollet, signer, client,
+                                        {network.policy_asset(): faucetSplitAmount,
+                                         assetid: faucetSplitAmountTest},
+                                        faucetCoinPool, faucetFeeMargin, faucetPoolInterval,
+                                        faucetSyncInterval, faucetMaxStale)
+        service.attach_wallet(coordinator, str(wollet.address(1).address()))
+        coordinator.start()
+        print(coordinator.balance)
+
+    def start_amp0():
+        # amp0 wallet, logging in is the slow part of the startup
+        amp_id = ""
+        amp0 = Amp0(network, amp0_user, amp0_password, amp_id)
+        amp0_wollet = Wollet(network, amp0.wollet_descriptor(), datadir='./.lwk_data_amp0')
+        b2 = EsploraClientBuilder(
+            base_url="https://waterfalls.liquidwebwallet.org/liquidtestnet/api",
+            network=network,
+            waterfalls=True,
+            utxo_only=True,
+        )
+        amp0_client = EsploraClient.from_builder(b2)
+        amp_payout = AmpPayout(network, amp0, amp0_wollet, amp0_client, amp0_mnemonic,
+                               ampUrl, ampToken, amp0_assetid, ampGaidTTL,
+                               faucetSyncInterval, faucetMaxStale)
+        service.attach_amp(amp_payout, str(amp0.address(1).address()))
+        amp_payout.start()
+        print(amp_payout.balance)
+
+    # both wallets start at the same time while the socket is already served
+    for name, start in (('lwk', start_wallet), ('amp0', start_amp0)):
+        threading.Thread(target=warm_up, args=(service, name, start, faucetSyncInterval),
+                         daemon=True).start()
+
+    server = PayoutServer(faucetSocket, service)
+    print('Payout daemon listening on ' + faucetSocket)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
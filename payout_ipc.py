@@ -0,0 +1,63 @@
+#    MIT License - Valerio Vaccaro
+#    Line delimited JSON calls between the web workers and the payout daemon
+
+import json
+import os
+import socket
+import socketserver
+
+
+class PayoutHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                method = request['method']
+                if method not in self.server.methods:
+                    raise Exception('Unknown method ' + str(method))
+                result = getattr(self.server.service, method)(*request.get('params', []))
+                response = {'result': result, 'error': None}
+            except Exception as e:
+                response = {'result': None, 'error': str(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+
+class PayoutServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        # only the methods listed in service.METHODS can be called by the
+        # web workers, the rest of the service stays private to the daemon
+        if os.path.exists(path):
+            os.unlink(path)
+        self.service = service
+        self.methods = frozenset(service.METHODS)
+        socketserver.UnixStreamServer.__init__(self, path, PayoutHandler)
+
+
+class PayoutClient(object):
+    def __init__(self, path, timeout=120):
+        self._path = path
+        self._timeout = timeout
+
+    def call(self, method, *params):
+        # a connection per call, a payout is never sent twice because a
+        # kept alive connection went away under it
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            try:
+                sock.connect(self._path)
+            except OSError:
+                raise Exception('Payout daemon unavailable')
+            sock.sendall((json.dumps({'method': method, 'params': params}) + '\n').encode())
+            line = sock.makefile('rb').readline()
+        finally:
+            sock.close()
+        if not line:
+            raise Exception('Payout daemon closed the connection')
+        response = json.loads(line)
+        if response['error'] is not None:
+            raise Exception(response['error'])
+        return response['result']
@@ -0,0 +1,59 @@
+#    MIT License - Valerio Vaccaro
+#    Sampling profiler reporting where slow requests spent their time
+
+import collections
+import sys
+import threading
+import time
+
+
+class SlowRequestProfiler(object):
+    def __init__(self, threshold, interval=0.005, depth=12, top=5):
+        # only threads inside a request are sampled, and only requests
+        # slower than threshold seconds are reported
+        self._threshold = threshold
+        self._interval = interval
+        self._depth = depth
+        self._top = top
+        self._lock = threading.Lock()
+        self._active = {}
+        self._thread = None
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self._depth:
+            code = frame.f_code
+            stack.append(code.co_filename.split('/')[-1] + ':' + str(frame.f_lineno) +
+                         ' ' + code.co_name)
+            frame = frame.f_back
+        return ' < '.join(stack)
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            with self._lock:
+                if len(self._active) == 0:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[self._stack(frame)] += 1
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = collections.Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def end(self, name, duration):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or duration < self._threshold:
+            return
+        total = sum(samples.values())
+        print('Slow request ' + name + ' took ' + str(round(duration, 3)) + 's, ' +
+              str(total) + ' samples:')
+        for stack, count in samples.most_common(self._top):
+            print('  ' + str(round(100.0 * count / total)) + '% ' + stack)
@@ -0,0 +1,79 @@
+#    MIT License - Valerio Vaccaro
+#    Rate limit counters in SQLite, shared by every worker process
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from limits.storage import Storage
+
+
+class SQLiteStorage(Storage):
+    # sqlite:///absolute/path or sqlite://relative/path, registered with
+    # limits when this module is imported
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self._path = uri[len('sqlite://'):] or './.ratelimit.sqlite'
+        self._local = threading.local()
+        self._cleanup = float(options.get('cleanup', 0.001))
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._db().execute('CREATE TABLE IF NOT EXISTS counters ('
+                           'key TEXT PRIMARY KEY, count INTEGER NOT NULL, '
+                           'expiry REAL NOT NULL) WITHOUT ROWID')
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _db(self):
+        # one connection per thread and process, WAL lets the workers read
+        # while another one writes
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def incr(self, key, expiry, amount=1):
+        # a single statement, so concurrent workers never lose a hit
+        now = time.time()
+        db = self._db()
+        row = db.execute('INSERT INTO counters VALUES (?, ?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET '
+                         'count = CASE WHEN expiry <= ? THEN excluded.count '
+                         'ELSE count + excluded.count END, '
+                         'expiry = CASE WHEN expiry <= ? THEN excluded.expiry '
+                         'ELSE expiry END RETURNING count',
+                         (key, amount, now + expiry, now, now)).fetchone()
+        if random.random() < self._cleanup:
+            db.execute('DELETE FROM counters WHERE expiry <= ?', (now,))
+        return row[0]
+
+    def get(self, key):
+        row = self._db().execute('SELECT count FROM counters WHERE key = ? AND expiry > ?',
+                                 (key, time.time())).fetchone()
+        return row[0] if row is not None else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._db().execute('SELECT expiry FROM counters WHERE key = ? AND expiry > ?',
+                                 (key, now)).fetchone()
+        return row[0] if row is not None else now
+
+    def check(self):
+        try:
+            self._db().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._db().execute('DELETE FROM counters').rowcount
+
+    def clear(self, key):
+        self._db().execute('DELETE FROM counters WHERE key = ?', (key,))
@@ -0,0 +1,92 @@
+// Live updates pushed by /api/events, the pages stay usable without them
+var live = (function () {
+  function listen(handlers) {
+    if (!window.EventSource) {
+      return;
+    }
+    var source = new EventSource('/api/events');
+    // events were lost while disconnected, start again from a fresh page
+    source.addEventListener('reset', function () {
+      location.reload();
+    });
+    $.each(handlers, function (name, handler) {
+      source.addEventListener(name, function (e) {
+        handler(JSON.parse(e.data));
+      });
+    });
+  }
+
+  function home() {
+    listen({
+      stats: function (stats) {
+        $.each(['height', 'mempool', 'space', 'uname', 'uptime'], function (i, key) {
+          $('#stats-' + key).text(stats[key]);
+        });
+      }
+    });
+  }
+
+  function explorer(rows) {
+    var body = $('#blocks');
+    listen({
+      tip: function (tip) {
+        if (tip.blocks.length === 0) {
+          return;
+        }
+        // replaced blocks go away, the page keeps the same number of rows
+        var lowest = tip.blocks[tip.blocks.length - 1].id;
+        body.children('tr').filter(function () {
+          return $(this).data('height') >= lowest;
+        }).remove();
+        $.each(tip.blocks.slice().reverse(), function (i, b) {
+          var link = $('<a>').attr('href', 'block?height=' + b.id).text(b.id);
+          var esplora = $('<a>').attr({href: 'https://blockstream.info/liquidtestnet/' + b.id,
+                                       target: '_blank'}).text('On Esplora');
+          var row = $('<tr>').attr('data-height', b.id).append(
+            $('<td>').append(link, ' ', esplora, ' '),
+            $('<td>').text(b.hash), $('<td>').text(b.size),
+            $('<td>').text(b.time), $('<td>').text(b.nTx));
+          body.prepend(row);
+        });
+        body.children('tr').slice(rows).remove();
+      }
+    });
+  }
+
+  function mempool(sequence, last_page) {
+    var list = $('#transactions');
+    listen({
+      mempool: function (changes) {
+        if (changes.sequence <= sequence) {
+          return;
+        }
+        // the page and the events can come from different worker processes,
+        // a change list starting earlier still applies as it only repeats
+        // changes the page already has
+        if (changes.since > sequence) {
+          location.reload();
+          return;
+        }
+        sequence = changes.sequence;
+        $.each(changes.removed, function (i, txid) {
+          list.children('div[data-txid="' + txid + '"]').remove();
+        });
+        // new transactions are appended, so only the last page shows them
+        if (last_page) {
+          $.each(changes.added, function (i, txid) {
+            if (list.children('div[data-txid="' + txid + '"]').length > 0) {
+              return;
+            }
+            list.append($('<div>').attr('data-txid', txid).append(
+              $('<a>').css('word-wrap', 'break-word').attr('href', './transaction?txid=' + txid).text(txid), ' ',
+              $('<a>').css('word-wrap', 'break-word').attr({href: 'https://blockstream.info/liquidtestnet/' + txid,
+                                                           target: '_blank'}).text('On Esplora')));
+          });
+        }
+        $('#total').text(changes.total);
+      }
+    });
+  }
+
+  return {home: home, explorer: explorer, mempool: mempool};
+})();
@@ -0,0 +1,73 @@
+#    MIT License - Valerio Vaccaro
+#    Mustache templates parsed once and composed from shared partials
+
+import os
+import re
+import threading
+import pystache
+from pystache.parser import parse
+from cache import LRUCache
+
+PARTIAL = re.compile(r'\{\{>\s*([\w.-]+)\s*\}\}')
+
+
+class TemplateEngine(object):
+    def __init__(self, directory, debug=False, cache_bytes=8 * 1024 * 1024,
+                 extension='mustache'):
+        self._directory = directory
+        self._debug = debug
+        self._cache_bytes = cache_bytes
+        self._extension = extension
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._stamp = None
+        self._pages = LRUCache(cache_bytes, 'pages')
+        self.load()
+
+    def _path(self, name):
+        return os.path.join(self._directory, name + '.' + self._extension)
+
+    def _source(self, name, parents=()):
+        # partials are inlined before parsing, pystache would otherwise
+        # load and parse them again on every render
+        if name in parents:
+            raise Exception('Recursive partial ' + name)
+        with open(self._path(name), encoding='utf-8') as f:
+            text = f.read()
+        if len(parents) > 0 and text.endswith('\n'):
+            text = text[:-1]
+        return PARTIAL.sub(lambda m: self._source(m.group(1), parents + (name,)), text)
+
+    def _mtime(self):
+        return max([os.path.getmtime(os.path.join(self._directory, f))
+                    for f in os.listdir(self._directory)] + [0])
+
+    def load(self):
+        suffix = '.' + self._extension
+        templates = {}
+        for f in os.listdir(self._directory):
+            if f.endswith(suffix):
+                name = f[:-len(suffix)]
+                templates[name] = parse(self._source(name))
+        with self._lock:
+            self._templates = templates
+            self._stamp = self._mtime()
+            # rendered pages may come from the old templates
+            self._pages = LRUCache(self._cache_bytes, 'pages')
+
+    def _check(self):
+        if self._debug and self._mtime() != self._stamp:
+            self.load()
+
+    def cached(self, key):
+        self._check()
+        return self._pages.get(key)
+
+    def render(self, name, context, key=None):
+        # key marks a page fully determined by its inputs, it is kept and
+        # served by cached(key) without building the context again
+        self._check()
+        page = pystache.Renderer().render(self._templates[name], context)
+        if key is not None:
+            self._pages.set(key, page, len(page))
+        return page
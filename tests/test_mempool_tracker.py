@@ -0,0 +1,114 @@
+#    MIT License - Valerio Vaccaro
+#    MempoolTracker against a scripted stand-in node
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bitcoin_rpc_class import RPCError, RPCUnavailable
+from mempool_tracker import MempoolTracker
+
+
+class StandIn(object):
+    # serves the mempool set by the test; failures are raised, in order,
+    # before answering again
+    def __init__(self, sequence=True):
+        self.txids = []
+        self.sequence = 100
+        self.failures = []
+        self._with_sequence = sequence
+
+    def set(self, txids):
+        self.txids = list(txids)
+        self.sequence += 1
+
+    def call(self, method, *params):
+        assert method == 'getrawmempool'
+        if len(self.failures) > 0:
+            raise self.failures.pop(0)
+        if len(params) == 0:
+            return list(self.txids)
+        if not self._with_sequence:
+            raise RPCError({'code': -1, 'message': 'getrawmempool ( verbose )'})
+        return {'txids': list(self.txids), 'mempool_sequence': self.sequence}
+
+
+@pytest.fixture
+def node():
+    return StandIn()
+
+
+def test_node_sequence(node):
+    tracker = MempoolTracker(node)
+    node.set(['a', 'b'])
+    assert tracker.refresh() == ['a', 'b']
+    assert tracker.sequence == node.sequence
+
+
+def test_older_node_counts_locally():
+    node = StandIn(sequence=False)
+    tracker = MempoolTracker(node)
+    node.set(['a'])
+    tracker.refresh()
+    node.set(['a', 'b'])
+    tracker.refresh()
+    assert tracker.sequence == 2
+    assert tracker.changes(1) == {'sequence': 2, 'reset': False, 'added': ['b'], 'removed': []}
+
+
+def test_transient_failures_keep_the_node_sequence(node):
+    tracker = MempoolTracker(node)
+    node.set(['a'])
+    node.failures = [RPCUnavailable('down', 5), RPCError({'code': -28, 'message': 'Loading block index'})]
+    for i in range(2):
+        with pytest.raises(Exception):
+            tracker.refresh()
+    assert tracker.refresh() == ['a']
+    assert tracker.sequence == node.sequence
+
+
+def test_changes(node):
+    tracker = MempoolTracker(node)
+    node.set(['a', 'b'])
+    tracker.refresh()
+    since = tracker.sequence
+    node.set(['b', 'c'])
+    tracker.refresh()
+    # added then removed again cancels out
+    node.set(['b', 'd'])
+    tracker.refresh()
+    assert tracker.txids() == ['b', 'd']
+    assert tracker.changes(since) == {'sequence': node.sequence, 'reset': False,
+                                      'added': ['d'], 'removed': ['a']}
+    assert tracker.changes(tracker.sequence)['added'] == []
+
+
+def test_truncated_log_resets(node):
+    tracker = MempoolTracker(node, history=2)
+    node.set(['a'])
+    tracker.refresh()
+    first = tracker.sequence
+    for txids in (['a', 'b'], ['b'], ['c']):
+        node.set(txids)
+        tracker.refresh()
+    assert tracker.changes(first) == {'sequence': node.sequence, 'reset': True, 'txids': ['c']}
+
+
+def test_sequence_of_another_worker(node):
+    # the node numbered a state this tracker never polled, the entry
+    # around it still covers the changes since
+    tracker = MempoolTracker(node)
+    node.set(['a'])
+    tracker.refresh()
+    node.set(['a', 'b'])
+    missed = node.sequence
+    node.set(['a', 'b', 'c'])
+    tracker.refresh()
+    data = tracker.changes(missed)
+    assert data['reset'] is False
+    assert data['added'] == ['b', 'c']
+    # beyond the node sequence it is a reset
+    assert tracker.changes(node.sequence + 1)['reset'] is True
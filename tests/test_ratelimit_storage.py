@@ -0,0 +1,87 @@
+#    MIT License - Valerio Vaccaro
+#    SQLiteStorage counters and their windows
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratelimit_storage
+from limits.storage import storage_from_string
+from ratelimit_storage import SQLiteStorage
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit_storage.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteStorage('sqlite://' + str(tmp_path / 'ratelimit.sqlite'), cleanup=0)
+
+
+def test_registered_with_limits(tmp_path):
+    storage = storage_from_string('sqlite://' + str(tmp_path / 'ratelimit.sqlite'))
+    assert isinstance(storage, SQLiteStorage)
+    assert storage.check()
+
+
+def test_incr_within_the_window(storage, clock):
+    assert storage.incr('a', 60) == 1
+    assert storage.incr('a', 60, amount=2) == 3
+    assert storage.incr('b', 60) == 1
+    assert storage.get('a') == 3
+    assert storage.get_expiry('a') == 1060
+
+
+def test_window_expiry(storage, clock):
+    storage.incr('a', 60)
+    storage.incr('a', 60)
+    clock[0] += 59
+    # a hit late in the window does not extend it
+    assert storage.incr('a', 60) == 3
+    assert storage.get_expiry('a') == 1060
+    clock[0] += 1
+    assert storage.get('a') == 0
+    assert storage.get_expiry('a') == clock[0]
+    # the next hit starts a new window
+    assert storage.incr('a', 60) == 1
+    assert storage.get_expiry('a') == 1120
+
+
+def test_cleanup_removes_expired_counters(tmp_path, clock):
+    storage = SQLiteStorage('sqlite://' + str(tmp_path / 'ratelimit.sqlite'), cleanup=1)
+    storage.incr('a', 10)
+    clock[0] += 10
+    storage.incr('b', 10)
+    keys = [row[0] for row in storage._db().execute('SELECT key FROM counters')]
+    assert keys == ['b']
+
+
+def test_clear_and_reset(storage, clock):
+    storage.incr('a', 60)
+    storage.incr('b', 60)
+    storage.clear('a')
+    assert storage.get('a') == 0
+    assert storage.get('b') == 1
+    assert storage.reset() == 1
+    assert storage.get('b') == 0
+
+
+def test_concurrent_hits_are_not_lost(storage):
+    def hit():
+        for i in range(50):
+            storage.incr('a', 60)
+
+    threads = [threading.Thread(target=hit) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert storage.get('a') == 400
@@ -0,0 +1,63 @@
+#    MIT License - Valerio Vaccaro
+#    read_transactions over bodies read a few bytes at a time
+
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tx_stream import read_transactions
+
+TX1 = '0200' * 8
+TX2 = 'ab' * 20
+TX3 = 'CD' * 10
+
+
+def read(body, chunk_size=3):
+    return list(read_transactions(io.BytesIO(body.encode()), chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 65536])
+def test_array_split_across_chunks(chunk_size):
+    body = ' [ "%s",\n"%s" , ["%s", "%s"] ] \n' % (TX1, TX2, TX2, TX3)
+    assert read(body, chunk_size) == [TX1, TX2, [TX2, TX3]]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 65536])
+def test_lines(chunk_size):
+    body = '\n%s\n\n%s %s\n%s' % (TX1, TX2, TX3, TX3)
+    assert read(body, chunk_size) == [TX1, [TX2, TX3], TX3]
+
+
+def test_empty():
+    assert read('') == []
+    assert read(' [ ] ') == []
+
+
+def test_items_are_yielded_before_the_end():
+    # the second item is invalid, the first one is already out by then
+    items = read_transactions(io.BytesIO(('["%s", "xyz"]' % TX1).encode()), 4)
+    assert next(items) == TX1
+    with pytest.raises(Exception, match='Invalid transaction hex'):
+        next(items)
+
+
+def test_trailing_data():
+    with pytest.raises(Exception, match='Unexpected data'):
+        read('["%s"] ["%s"]' % (TX1, TX2))
+    with pytest.raises(Exception, match='Unexpected data'):
+        read('["%s"]' % TX1 + ' ' * 10 + 'x', chunk_size=2)
+
+
+def test_truncated():
+    with pytest.raises(Exception, match='Truncated'):
+        read('["%s", "%s' % (TX1, TX2))
+
+
+@pytest.mark.parametrize('body', ['["abc"]', '[12]', '[[]]', 'zz'])
+def test_invalid(body):
+    with pytest.raises(Exception):
+        read(body)
@@ -0,0 +1,96 @@
+#    MIT License - Valerio Vaccaro
+#    Cache of decoded transactions with an optional on-disk tier
+
+import json
+import sqlite3
+import threading
+import zlib
+from cache import LRUCache, TTLCache
+from metrics import cache_lookup
+
+# stands in for the number of confirmations while serializing
+PLACEHOLDER = -1
+
+
+class TransactionCache(object):
+    def __init__(self, max_bytes, mempool_ttl=5, path=None, reorg_depth=6):
+        # transactions deeper than reorg_depth never change, they are kept
+        # without their number of confirmations which is added for the tip
+        # when served; shallower and unconfirmed ones only live mempool_ttl
+        self._confirmed = LRUCache(max_bytes)
+        self._mempool = TTLCache(mempool_ttl)
+        self._reorg_depth = reorg_depth
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            # the old table kept the confirmations of shallow transactions
+            self._db.execute('DROP TABLE IF EXISTS txs')
+            self._db.execute('CREATE TABLE IF NOT EXISTS transactions ('
+                             'txid TEXT PRIMARY KEY, height INTEGER NOT NULL, '
+                             'data BLOB NOT NULL)')
+            self._db.commit()
+
+    def _entry(self, data, height):
+        # the compact and the pretty printed JSON are both kept, so
+        # handlers never serialize the transaction again; each one split
+        # where the confirmations go
+        data = dict(data, confirmations=PLACEHOLDER)
+        field = '"confirmations": ' + str(PLACEHOLDER)
+        compact = json.dumps(data, sort_keys=True).split(field, 1)
+        pretty = json.dumps(data, indent=4, sort_keys=True).split(field, 1)
+        return compact, pretty, height
+
+    def _size(self, entry):
+        return sum([len(part) for part in entry[0] + entry[1]])
+
+    def _serve(self, entry, tip):
+        compact, pretty, height = entry
+        field = '"confirmations": ' + str(tip - height + 1)
+        return compact[0] + field + compact[1], pretty[0] + field + pretty[1]
+
+    def _load(self, txid):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT height, data FROM transactions WHERE txid = ?',
+                                   (txid,)).fetchone()
+        if row is None:
+            return None
+        entry = self._entry(json.loads(zlib.decompress(row[1])), row[0])
+        self._confirmed.set(txid, entry, self._size(entry))
+        return entry
+
+    def get(self, txid, tip):
+        # returns (json, pretty json) or None
+        cached = self._mempool.get(txid)
+        if cached is not None:
+            cache_lookup('transactions', True)
+            return cached
+        entry = self._confirmed.get(txid)
+        if entry is None:
+            entry = self._load(txid)
+        cache_lookup('transactions', entry is not None)
+        if entry is None:
+            return None
+        return self._serve(entry, tip)
+
+    def put(self, txid, data, tip):
+        confirmations = data.get('confirmations', 0)
+        if confirmations <= self._reorg_depth:
+            served = (json.dumps(data, sort_keys=True), json.dumps(data, indent=4, sort_keys=True))
+            self._mempool.set(txid, served)
+            return served
+        height = tip - confirmations + 1
+        entry = self._entry(data, height)
+        self._confirmed.set(txid, entry, self._size(entry))
+        if self._db is not None:
+            stored = dict(data)
+            del stored['confirmations']
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO transactions VALUES (?, ?, ?)',
+                                 (txid, height, zlib.compress(json.dumps(stored).encode())))
+                self._db.commit()
+        return self._serve(entry, tip)
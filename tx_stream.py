@@ -0,0 +1,87 @@
+#    MIT License - Valerio Vaccaro
+#    Incremental parsing of the raw transactions posted to the utils API
+
+import codecs
+import itertools
+import json
+import re
+
+HEX = re.compile(r'^[0-9a-fA-F]+$')
+
+
+def _check(item):
+    # a raw transaction, or a package as a list of them parents first
+    txs = item if isinstance(item, list) else [item]
+    if len(txs) == 0:
+        raise Exception('Empty package')
+    for tx in txs:
+        if not isinstance(tx, str) or len(tx) % 2 != 0 or not HEX.match(tx):
+            raise Exception('Invalid transaction hex')
+    return item
+
+
+def _chunks(stream, chunk_size):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if len(tail) > 0:
+                yield tail
+            return
+        yield decoder.decode(chunk)
+
+
+def _lines(buffer, chunks):
+    # one transaction per line, the transactions of a package on the same
+    # line separated by spaces
+    pending = ''
+    for chunk in itertools.chain([buffer], chunks):
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            txs = line.split()
+            if len(txs) > 0:
+                yield _check(txs[0] if len(txs) == 1 else txs)
+    txs = pending.split()
+    if len(txs) > 0:
+        yield _check(txs[0] if len(txs) == 1 else txs)
+
+
+def _array(buffer, chunks):
+    decoder = json.JSONDecoder()
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(']'):
+            if len(buffer[1:].strip()) > 0 or any([c.strip() for c in chunks]):
+                raise Exception('Unexpected data after the JSON array')
+            return
+        if buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except ValueError:
+            # the item is not complete yet
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise Exception('Truncated JSON array')
+            buffer += chunk
+            continue
+        yield _check(item)
+        buffer = buffer[end:]
+
+
+def read_transactions(stream, chunk_size=65536):
+    # the body is a JSON array or plain lines; items are yielded as soon as
+    # they are complete, so the body is never held as a whole
+    chunks = _chunks(stream, chunk_size)
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer.strip()) > 0:
+            break
+    buffer = buffer.lstrip()
+    if buffer.startswith('['):
+        return _array(buffer[1:], chunks)
+    return _lines(buffer, chunks)
@@ -0,0 +1,242 @@
+#    MIT License - Valerio Vaccaro
+#    Serialized access to the LWK wallet with a pool of pre-split coins
+
+import threading
+import time
+from lwk import Address
+from metrics import stage
+
+
+class BroadcastError(Exception):
+    # the node may have the transaction even though broadcast failed (a
+    # timeout, a lost reply), so its outputs must not be paid again
+    def __init__(self, txid, error):
+        Exception.__init__(self, 'Broadcast of ' + txid + ' failed: ' + str(error))
+        self.txid = txid
+
+
+class WalletCoordinator(object):
+    def __init__(self, network, wollet, signer, client, splits, pool_target=50,
+                 fee_margin=2000, interval=30, sync_interval=10, max_stale=60):
+        # splits maps every pooled asset id to the value of its pre-split coins
+        self.network = network
+        self.wollet = wollet
+        self._signer = signer
+        self._client = client
+        self._splits = splits
+        self._pool_target = pool_target
+        self._fee_margin = fee_margin
+        self._interval = interval
+        self._sync_interval = sync_interval
+        self._max_stale = max_stale
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._reserved = set()
+        self._thread = None
+        self.synced_height = None
+        self.synced_at = 0
+        self.balance = dict(wollet.balance())
+
+    def _balance_changed(self):
+        # handlers read self.balance without locking, the dict is replaced
+        # as a whole and only when the wallet changes
+        self.balance = dict(self.wollet.balance())
+
+    def sync(self):
+        # the scan runs without holding the wallet lock, so payouts keep
+        # going; only applying the update is serialized with them. An update
+        # raced by a local payout no longer applies, the scan is run again
+        # once so callers on the request path do not fail for it
+        with self._sync_lock, stage('sync'):
+            height = self._client.tip().height()
+            for attempt in range(2):
+                update = self._client.full_scan(self.wollet)
+                if update is None:
+                    break
+                try:
+                    with self._lock:
+                        self.wollet.apply_update(update)
+                        self._balance_changed()
+                    break
+                except Exception:
+                    if attempt == 1:
+                        raise
+            self.synced_height = height
+            self.synced_at = time.time()
+
+    def stale(self):
+        return time.time() - self.synced_at > self._max_stale
+
+    def ensure_synced(self):
+        # the background sync keeps the wallet current, requests only pay
+        # for a scan when it has fallen behind
+        if self.stale():
+            self.sync()
+
+    def sync_status(self):
+        return {'height': self.synced_height, 'time': int(self.synced_at),
+                'stale': self.stale()}
+
+    def _coins(self, asset):
+        coins = []
+        for utxo in self.wollet.utxos():
+            outpoint = utxo.outpoint()
+            key = (str(outpoint.txid()), outpoint.vout())
+            if key in self._reserved or str(utxo.unblinded().asset()) != asset:
+                continue
+            coins.append((utxo.unblinded().value(), key, outpoint))
+        return coins
+
+    def _reserve(self, needs, largest_first=False):
+        # pick unreserved coins covering needs ({asset: sats}), preferring a
+        # single pre-split coin so concurrent payouts never share an input
+        picked = []
+        for asset, amount in needs.items():
+            coins = sorted(self._coins(asset), key=lambda c: c[0])
+            single = [c for c in coins if c[0] >= amount]
+            if len(single) > 0 and not largest_first:
+                chosen = [single[0]]
+            else:
+                chosen = []
+                total = 0
+                for c in reversed(coins):
+                    if total >= amount:
+                        break
+                    chosen.append(c)
+                    total += c[0]
+                if total < amount:
+                    raise Exception('Insufficient funds for asset ' + asset)
+            picked += chosen
+        for c in picked:
+            self._reserved.add(c[1])
+        return picked
+
+    def _release(self, picked):
+        with self._lock:
+            for c in picked:
+                self._reserved.discard(c[1])
+
+    def transact(self, build, needs, largest_first=False):
+        # build(builder) adds the outputs, needs lists the sats per asset
+        # they spend; the L-BTC fee margin is added here
+        needs = dict(needs)
+        policy = str(self.network.policy_asset())
+        needs[policy] = needs.get(policy, 0) + self._fee_margin
+
+        with self._lock:
+            try:
+                picked = self._reserve(needs, largest_first)
+            except Exception:
+                # funds received since the last scan are not spendable yet
+                if time.time() - self.synced_at < self._sync_interval / 2:
+                    raise
+                picked = None
+        if picked is None:
+            self.sync()
+            with self._lock:
+                picked = self._reserve(needs, largest_first)
+
+        with self._lock:
+            try:
+                with stage('finish'):
+                    builder = self.network.tx_builder()
+                    build(builder)
+                    builder.set_wallet_utxos([c[2] for c in picked])
+                    unsigned_pset = builder.finish(self.wollet)
+            except Exception:
+                self._release(picked)
+                raise
+
+        try:
+            # signing and broadcasting run outside the lock, in parallel
+            # with the other payouts
+            with stage('sign'):
+                signed_pset = self._signer.sign(unsigned_pset)
+            with self._lock:
+                finalized_pset = self.wollet.finalize(signed_pset)
+            tx = finalized_pset.extract_tx()
+            txid = tx.txid()
+            try:
+                with stage('broadcast'):
+                    self._client.broadcast(tx)
+            except Exception as e:
+                raise BroadcastError(str(txid), e)
+            try:
+                with self._lock:
+                    self.wollet.apply_transaction(tx)
+                    self._balance_changed()
+            except Exception as e:
+                # the payout is out, the next sync brings the wallet up to date
+                print('Applying transaction ' + str(txid) + ' failed: ' + str(e))
+        finally:
+            self._release(picked)
+        return str(txid), signed_pset
+
+    def pay(self, recipients):
+        # recipients are (address, amount, asset, confidential) tuples
+        needs = {}
+        for address, amount, asset, confidential in recipients:
+            needs[str(asset)] = needs.get(str(asset), 0) + amount
+
+        def build(builder):
+            for address, amount, asset, confidential in recipients:
+                if confidential:
+                    builder.add_recipient(Address(address), amount, asset)
+                else:
+                    builder.add_explicit_recipient(Address(address), amount, asset)
+
+        txid, signed_pset = self.transact(build, needs)
+        return txid
+
+    def pool_size(self, asset):
+        with self._lock:
+            split = self._splits[asset]
+            return len([c for c in self._coins(asset) if split <= c[0] < 2 * split])
+
+    def top_up(self):
+        # fan out the large coins into pre-split ones when the pool runs low
+        policy = str(self.network.policy_asset())
+        with self._lock:
+            missing = {}
+            for asset, split in self._splits.items():
+                # only coins worth at least two splits are broken up, the
+                # pool is never consolidated into itself
+                spare = sum([c[0] for c in self._coins(asset) if c[0] >= 2 * split])
+                if asset == policy:
+                    spare -= self._fee_margin
+                n = min(self._pool_target - self.pool_size(asset), spare // split)
+                if n > 0:
+                    missing[asset] = n
+            if len(missing) == 0:
+                return None
+            address = self.wollet.address(None).address()
+
+        def build(builder):
+            for asset, n in missing.items():
+                for i in range(n):
+                    builder.add_recipient(address, self._splits[asset], asset)
+
+        needs = {asset: n * self._splits[asset] for asset, n in missing.items()}
+        txid, signed_pset = self.transact(build, needs, largest_first=True)
+        print('Split ' + str(sum(missing.values())) + ' coins with transaction ' + txid)
+        return txid
+
+    def _run(self):
+        topped_up = 0
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                print('Wallet sync failed: ' + str(e))
+            if time.time() - topped_up > self._interval:
+                topped_up = time.time()
+                try:
+                    self.top_up()
+                except Exception as e:
+                    print('Coin pool top up failed: ' + str(e))
+            time.sleep(self._sync_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()